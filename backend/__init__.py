@@ -0,0 +1,6 @@
+"""Local MLX inference server, chat clients and tooling for cupertino_ink.
+
+Submodules import their heavy dependencies (mlx, mlx_lm, fastapi, openai)
+themselves, so importing the package or running `cupertino --help` stays
+cheap. See `cupertino.cli` for the command-line entry point.
+"""
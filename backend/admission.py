@@ -0,0 +1,298 @@
+"""Memory-watermark admission control for the generation server.
+
+Every request's KV-cache and activation footprint is estimated from its
+prompt length and `max_tokens` before it reaches the scheduler. A request
+is admitted when the projected memory stays under the high watermark.
+Otherwise it waits in a FIFO queue until enough memory is released. When
+the queue is full, the wait times out, or live memory is already above the
+reject watermark, it fails fast with `AdmissionRejected` (HTTP 429). A
+queued request is far cheaper than swapping or an OOM followed by a cold
+model reload.
+
+Memory held by caches that can be rebuilt (the scheduler's prefix cache) is
+not a reason to turn a request away. A `reclaim(nbytes)` hook, if given, is
+asked to free that much before a request is queued or rejected, and again
+while the head of the queue waits.
+
+All methods run on the server's event loop; only MLX memory is read from
+the engine.
+"""
+
+import asyncio
+import os
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Optional
+
+import mlx.core as mx
+from mlx_lm.models.cache import make_prompt_cache
+
+from . import mlx_memory
+
+DEFAULT_HIGH_WATERMARK = 0.85
+DEFAULT_REJECT_WATERMARK = 0.95
+DEFAULT_MAX_QUEUE_DEPTH = 64
+DEFAULT_MAX_QUEUE_WAIT = 30.0  # seconds
+_POLL_INTERVAL = 0.5  # re-check live memory while queued
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be admitted; maps to an HTTP error."""
+
+    def __init__(self, message: str, status_code: int = 429, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def system_memory_limit() -> int:
+    """Memory the engine may use: the GPU working set, else physical RAM."""
+    limit = mlx_memory.device_memory_limit()
+    if limit:
+        return limit
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+
+
+# --- Estimation ---
+class MemoryEstimator:
+    """Per-request memory estimate for one loaded model."""
+
+    def __init__(self, kv_bytes_per_token: int, activation_bytes_per_token: int, prefill_chunk_size: int):
+        self.kv_bytes_per_token = kv_bytes_per_token
+        self.activation_bytes_per_token = activation_bytes_per_token
+        self.prefill_chunk_size = prefill_chunk_size
+
+    @classmethod
+    def from_model(cls, model, prefill_chunk_size: int):
+        """Measure KV bytes per token by running one token through the model.
+
+        This works for any cache layout mlx_lm builds (GQA, sliding window,
+        quantized) without reading architecture-specific config fields.
+        Activations are estimated from the hidden, MLP and vocab widths of a
+        single prefill chunk; the logits for the chunk dominate.
+        """
+        cache = make_prompt_cache(model)
+        model(mx.array([[0]]), cache=cache)
+        states = [c.state for c in cache]
+        mx.eval(states)
+        # Caches preallocate in steps, so normalize each (B, H, T, D) buffer by T
+        kv_bytes = sum(a.nbytes // a.shape[2] for a in _flatten(states) if a.ndim == 4)
+        del cache, states
+
+        args = getattr(model, "args", None)
+        hidden = getattr(args, "hidden_size", 4096)
+        intermediate = getattr(args, "intermediate_size", 4 * hidden)
+        vocab = getattr(args, "vocab_size", 32000)
+        # fp16 residual stream, q/k/v/o projections and MLP, plus fp32 logits
+        activation_bytes = 2 * (4 * hidden + 2 * intermediate) + 4 * vocab
+        return cls(kv_bytes, activation_bytes, prefill_chunk_size)
+
+    def estimate(self, prompt_tokens: int, max_tokens: int) -> int:
+        kv = self.kv_bytes_per_token * (prompt_tokens + max_tokens)
+        activations = self.activation_bytes_per_token * min(prompt_tokens, self.prefill_chunk_size)
+        return kv + activations
+
+
+def _flatten(tree):
+    if isinstance(tree, (list, tuple)):
+        for item in tree:
+            yield from _flatten(item)
+    elif isinstance(tree, mx.array):
+        yield tree
+
+
+# --- Admission ---
+@dataclass
+class AdmissionStats:
+    admitted: int = 0
+    rejected: int = 0
+    queued: int = 0
+    total_wait_s: float = 0.0
+    max_wait_s: float = 0.0
+    reclaimed_bytes: int = 0
+
+
+class Reservation:
+    """Memory held by one admitted request. `release()` is idempotent."""
+
+    def __init__(self, controller, nbytes: int):
+        self._controller = controller
+        self.nbytes = nbytes
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self._controller._release(self.nbytes)
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        estimator: MemoryEstimator,
+        memory_limit: Optional[int] = None,
+        high_watermark: float = DEFAULT_HIGH_WATERMARK,
+        reject_watermark: float = DEFAULT_REJECT_WATERMARK,
+        max_queue_depth: int = DEFAULT_MAX_QUEUE_DEPTH,
+        max_queue_wait: float = DEFAULT_MAX_QUEUE_WAIT,
+        reclaim=None,
+    ):
+        """`reclaim(nbytes)` frees evictable memory and returns the bytes freed.
+
+        It may be a coroutine function (the server evicts on the engine thread).
+        """
+        self.estimator = estimator
+        self.reclaim = reclaim
+        self.memory_limit = memory_limit or system_memory_limit()
+        self.high_watermark = high_watermark
+        self.reject_watermark = reject_watermark
+        self.max_queue_depth = max_queue_depth
+        self.max_queue_wait = max_queue_wait
+        # Weights and other resident state measured once the model is loaded
+        self.base_bytes = mlx_memory.active_memory()
+        self.reserved_bytes = 0
+        self.in_flight = 0
+        self.stats = AdmissionStats()
+        self._waiters = deque()  # (nbytes, future, enqueued_at)
+
+    @property
+    def high_bytes(self) -> int:
+        return int(self.memory_limit * self.high_watermark)
+
+    def projected_bytes(self) -> int:
+        """Memory in use or promised: live MLX memory, or reservations if larger."""
+        return max(mlx_memory.active_memory(), self.base_bytes + self.reserved_bytes)
+
+    def _fits(self, nbytes: int) -> bool:
+        return self.projected_bytes() + nbytes <= self.high_bytes
+
+    async def _reclaim(self, nbytes: int):
+        if self.reclaim is None or nbytes <= 0:
+            return
+        freed = self.reclaim(nbytes)
+        if hasattr(freed, "__await__"):
+            freed = await freed
+        self.stats.reclaimed_bytes += freed or 0
+
+    async def _make_room(self, nbytes: int):
+        """Reclaim whatever keeps `nbytes` more from fitting under the high watermark."""
+        await self._reclaim(self.projected_bytes() + nbytes - self.high_bytes)
+
+    async def acquire(self, prompt_tokens: int, max_tokens: int) -> Reservation:
+        """Reserve memory for a request, waiting in the queue if needed."""
+        nbytes = self.estimator.estimate(prompt_tokens, max_tokens)
+        if self.base_bytes + nbytes > self.high_bytes:
+            self.stats.rejected += 1
+            raise AdmissionRejected(
+                f"Request needs ~{nbytes / 1e9:.2f} GB (prompt {prompt_tokens} + max_tokens {max_tokens} tokens), "
+                f"more than the {self.high_bytes / 1e9:.2f} GB the server admits. Shorten the prompt or lower max_tokens.",
+                status_code=413,
+            )
+        reject_bytes = int(self.memory_limit * self.reject_watermark)
+        if mlx_memory.active_memory() >= reject_bytes:
+            await self._reclaim(mlx_memory.active_memory() - reject_bytes + 1)
+        if mlx_memory.active_memory() >= reject_bytes:
+            self.stats.rejected += 1
+            raise AdmissionRejected(
+                "Server memory is above the reject watermark; retry shortly.", retry_after=self.max_queue_wait
+            )
+        if not self._waiters and not self._fits(nbytes):
+            await self._make_room(nbytes)
+        if not self._waiters and self._fits(nbytes):
+            return self._reserve(nbytes, waited=0.0)
+        if len(self._waiters) >= self.max_queue_depth:
+            self.stats.rejected += 1
+            raise AdmissionRejected(
+                f"Admission queue is full ({self.max_queue_depth} waiting); retry shortly.",
+                retry_after=self.max_queue_wait,
+            )
+
+        loop = asyncio.get_running_loop()
+        waiter = (nbytes, loop.create_future(), time.monotonic())
+        self._waiters.append(waiter)
+        self.stats.queued += 1
+        deadline = waiter[2] + self.max_queue_wait
+        try:
+            while not waiter[1].done():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                # Poll so memory freed outside release() (e.g. cache eviction) is noticed
+                done, _ = await asyncio.wait([waiter[1]], timeout=min(remaining, _POLL_INTERVAL))
+                if not done:
+                    if self._waiters and self._waiters[0] is waiter:
+                        await self._make_room(nbytes)
+                    self._wake()
+        except asyncio.CancelledError:
+            self._abandon(waiter)
+            raise
+        if waiter[1].done():
+            return waiter[1].result()
+        self._abandon(waiter)
+        self.stats.rejected += 1
+        raise AdmissionRejected(
+            f"Timed out after {self.max_queue_wait:.0f}s waiting for memory; retry shortly.",
+            retry_after=self.max_queue_wait,
+        )
+
+    def _reserve(self, nbytes: int, waited: float) -> Reservation:
+        self.reserved_bytes += nbytes
+        self.in_flight += 1
+        self.stats.admitted += 1
+        self.stats.total_wait_s += waited
+        self.stats.max_wait_s = max(self.stats.max_wait_s, waited)
+        return Reservation(self, nbytes)
+
+    def _abandon(self, waiter):
+        if waiter in self._waiters:
+            self._waiters.remove(waiter)
+        elif waiter[1].done() and not waiter[1].cancelled():
+            # Admitted just as the caller gave up; hand the memory back
+            waiter[1].result().release()
+        else:
+            waiter[1].cancel()
+
+    def _release(self, nbytes: int):
+        self.reserved_bytes -= nbytes
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self):
+        # Strict FIFO: a large request at the head is not starved by small ones
+        while self._waiters:
+            nbytes, future, enqueued_at = self._waiters[0]
+            if future.done():
+                self._waiters.popleft()
+                continue
+            if not self._fits(nbytes):
+                break
+            self._waiters.popleft()
+            future.set_result(self._reserve(nbytes, waited=time.monotonic() - enqueued_at))
+
+    def snapshot(self) -> dict:
+        """Queue and memory state for the stats endpoint."""
+        now = time.monotonic()
+        admitted = self.stats.admitted
+        return {
+            "queue_depth": len(self._waiters),
+            "oldest_wait_s": (now - self._waiters[0][2]) if self._waiters else 0.0,
+            "in_flight": self.in_flight,
+            "admitted": admitted,
+            "rejected": self.stats.rejected,
+            "queued": self.stats.queued,
+            "mean_wait_s": self.stats.total_wait_s / admitted if admitted else 0.0,
+            "max_wait_s": self.stats.max_wait_s,
+            "reclaimed_bytes": self.stats.reclaimed_bytes,
+            "memory": {
+                "limit_bytes": self.memory_limit,
+                "high_watermark_bytes": self.high_bytes,
+                "reject_watermark_bytes": int(self.memory_limit * self.reject_watermark),
+                "base_bytes": self.base_bytes,
+                "reserved_bytes": self.reserved_bytes,
+                "active_bytes": mlx_memory.active_memory(),
+                "peak_bytes": mlx_memory.peak_memory(),
+                "cache_bytes": mlx_memory.cache_memory(),
+            },
+        }
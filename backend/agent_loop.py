@@ -0,0 +1,247 @@
+"""Asyncio tool-calling agent loop.
+
+One `AgentSession` per conversation. `send(user_input)` is an async iterator
+of typed events that runs the whole loop: it streams the model's reply,
+merges `delta.tool_calls` by index, and falls back to parsing raw
+`<tool_call>` / `<|python_tag|>` / `[TOOL_CALLS]` text. It then runs the
+requested tools concurrently, appends the results to history, and calls the
+model again until it answers in plain text.
+
+Sessions hold no threads or sockets of their own. All of them share a single
+`AsyncOpenAI` client whose httpx pool caps the number of connections, so one
+event loop can drive thousands of conversations:
+
+    client = create_client(BASE_URL, max_connections=64)
+    sessions = [AgentSession(client, MODEL, tools, functions) for _ in range(1000)]
+
+    async def run(session, question):
+        async for event in session.send(question):
+            if isinstance(event, TextDelta):
+                ...
+
+    await asyncio.gather(*(run(s, q) for s, q in zip(sessions, questions)))
+
+Tool functions may be coroutine functions, which are awaited on the loop.
+Plain callables run in the loop's default executor so a slow tool doesn't
+block other sessions; `ToolSandbox.afunction` runs them out of process.
+"""
+
+import asyncio
+import inspect
+import json
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+from .tool_parsing import new_tool_call_id, parse_tool_calls
+
+DEFAULT_MAX_CONNECTIONS = 100
+DEFAULT_TIMEOUT = 60.0  # seconds per API call
+DEFAULT_MAX_TOOL_ROUNDS = 8  # model calls per user turn before giving up
+
+
+# --- Events ---
+@dataclass
+class TextDelta:
+    text: str
+
+
+@dataclass
+class ToolCallRequested:
+    id: str
+    name: str
+    arguments: Any  # dict once parsed; the raw string if it wasn't valid JSON
+
+
+@dataclass
+class ToolResult:
+    tool_call_id: str
+    name: str
+    content: str  # what was appended to history
+    error: Optional[str] = None
+
+
+@dataclass
+class TurnFinished:
+    message: Dict[str, Any]  # the final assistant message
+    finish_reason: Optional[str]
+    tool_rounds: int
+
+
+@dataclass
+class AgentError:
+    error: str
+    status_code: Optional[int] = None
+
+
+def create_client(
+    base_url: str,
+    api_key: str = "not-needed",
+    max_connections: int = DEFAULT_MAX_CONNECTIONS,
+    timeout: float = DEFAULT_TIMEOUT,
+):
+    """An `AsyncOpenAI` client on a pooled httpx client, meant to be shared.
+
+    Use it from a single event loop; httpx connections are bound to the loop
+    they were opened on.
+    """
+    import httpx
+    from openai import AsyncOpenAI
+
+    http_client = httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        timeout=timeout,
+    )
+    return AsyncOpenAI(base_url=base_url, api_key=api_key, http_client=http_client)
+
+
+class _ToolCallAccumulator:
+    """Merges streamed `delta.tool_calls` fragments by index."""
+
+    def __init__(self):
+        self.calls = {}
+
+    def add(self, fragments):
+        for fragment in fragments:
+            call = self.calls.setdefault(
+                fragment.index, {"id": None, "type": "function", "function": {"name": "", "arguments": ""}}
+            )
+            if fragment.id:
+                call["id"] = fragment.id
+            if fragment.function:
+                if fragment.function.name:
+                    call["function"]["name"] += fragment.function.name
+                if fragment.function.arguments:
+                    call["function"]["arguments"] += fragment.function.arguments
+
+    def finish(self) -> list:
+        calls = []
+        for index in sorted(self.calls):
+            call = self.calls[index]
+            if call["function"]["name"]:
+                call["id"] = call["id"] or new_tool_call_id()
+                calls.append(call)
+        return calls
+
+
+class AgentSession:
+    def __init__(
+        self,
+        client,
+        model: str,
+        tools: List[dict],
+        functions: Dict[str, Callable],
+        messages: Optional[list] = None,
+        tool_result_store=None,
+        raw_result_tools=("expand_result",),
+        max_tool_rounds: int = DEFAULT_MAX_TOOL_ROUNDS,
+        **request_params,
+    ):
+        """`functions` maps tool names to callables taking the tool's arguments.
+
+        With a `tool_result_store`, results go into history through
+        `to_message_content` (large ones as a digest). Tools in
+        `raw_result_tools` return content that is already sized for the
+        context and are appended as plain JSON. Extra keyword arguments
+        (`temperature`, `tool_choice`, ...) are passed to every completion
+        request.
+        """
+        self.client = client
+        self.model = model
+        self.tools = tools
+        self.functions = functions
+        self.messages = messages if messages is not None else []
+        self.tool_result_store = tool_result_store
+        self.raw_result_tools = set(raw_result_tools)
+        self.max_tool_rounds = max_tool_rounds
+        self.request_params = request_params
+
+    async def send(self, user_input: str):
+        """Add a user message and run the loop until the model answers."""
+        self.messages.append({"role": "user", "content": user_input})
+        async for event in self.run():
+            yield event
+
+    async def run(self):
+        """Continue from the current history (e.g. after a resume)."""
+        from openai import APIError
+
+        for round_number in range(self.max_tool_rounds):
+            try:
+                stream = await self.client.chat.completions.create(
+                    model=self.model, messages=list(self.messages), tools=self.tools, stream=True, **self.request_params
+                )
+                role, text, finish_reason = "assistant", "", None
+                accumulator = _ToolCallAccumulator()
+                # Closes the HTTP response even if the caller stops iterating early
+                async with stream:
+                    async for chunk in stream:
+                        if not chunk.choices:  # usage / prefill-progress chunks
+                            continue
+                        choice = chunk.choices[0]
+                        finish_reason = choice.finish_reason or finish_reason
+                        delta = choice.delta
+                        if delta.role:
+                            role = delta.role
+                        if delta.content:
+                            text += delta.content
+                            yield TextDelta(delta.content)
+                        if delta.tool_calls:
+                            accumulator.add(delta.tool_calls)
+            except APIError as e:
+                yield AgentError(getattr(e, "message", str(e)), getattr(e, "status_code", None))
+                return
+
+            tool_calls = accumulator.finish() or (parse_tool_calls(text) if text.strip() else [])
+            if not tool_calls:
+                message = {"role": role, "content": text}
+                self.messages.append(message)
+                yield TurnFinished(message, finish_reason, round_number)
+                return
+
+            self.messages.append({"role": role, "tool_calls": tool_calls})
+            requested = [self._parse_call(call) for call in tool_calls]
+            for event in requested:
+                yield event
+            for result in await asyncio.gather(*(self._execute(event) for event in requested)):
+                self.messages.append(
+                    {"role": "tool", "tool_call_id": result.tool_call_id, "name": result.name, "content": result.content}
+                )
+                yield result
+
+        yield AgentError(f"Stopped after {self.max_tool_rounds} tool-call rounds without a final answer")
+
+    @staticmethod
+    def _parse_call(call: dict) -> ToolCallRequested:
+        arguments = call["function"].get("arguments") or {}
+        if isinstance(arguments, str):
+            try:
+                arguments = json.loads(arguments) if arguments.strip() else {}
+            except json.JSONDecodeError:
+                pass  # left as a string; _execute reports it to the model
+        return ToolCallRequested(call["id"], call["function"]["name"], arguments)
+
+    async def _execute(self, call: ToolCallRequested) -> ToolResult:
+        def failed(error: str) -> ToolResult:
+            return ToolResult(call.id, call.name, json.dumps({"error": error}), error=error)
+
+        if not isinstance(call.arguments, dict):
+            return failed(f"Invalid/malformed JSON arguments from model: {call.arguments}")
+        function = self.functions.get(call.name)
+        if function is None:
+            return failed(f"Function '{call.name}' is not available/defined.")
+        try:
+            if inspect.iscoroutinefunction(function):
+                result = await function(**call.arguments)
+            else:
+                loop = asyncio.get_running_loop()
+                result = await loop.run_in_executor(None, lambda: function(**call.arguments))
+        except TypeError as e:
+            return failed(f"Argument mismatch calling function '{call.name}': {e}")
+        except Exception as e:
+            return failed(f"Error executing function '{call.name}': {e}")
+
+        if self.tool_result_store is None or call.name in self.raw_result_tools:
+            content = json.dumps(result)
+        else:
+            content = self.tool_result_store.to_message_content(result)
+        return ToolResult(call.id, call.name, content)
@@ -2,25 +2,120 @@
 
 import json
 
+import mlx.core as mx
+import mlx.nn as nn
+import numpy as np
 from mlx_lm import load, stream_generate
 
 # Specify the checkpoint
-checkpoint = "mlx-community/Qwen2.5-7B-Instruct-1M-4bit"
+DEFAULT_CHECKPOINT = "mlx-community/Qwen2.5-7B-Instruct-1M-4bit"
 
-# Load the corresponding model and tokenizer
-model, tokenizer = load(path_or_hf_repo=checkpoint)
 
-# Specify the prompt and conversation history
-prompt = "Write a story about Einstein"
-messages = [{"role": "user", "content": prompt}]
+def is_quantized(model) -> bool:
+    """True if any layer of `model` already holds quantized weights."""
+    return any(
+        isinstance(module, (nn.QuantizedLinear, nn.QuantizedEmbedding))
+        for _, module in model.named_modules()
+    )
 
-prompt = tokenizer.apply_chat_template(
-    messages, add_generation_prompt=True
-)
 
-# Generate the response using streaming:
-print(f"User: {messages[0]['content']}\n")
-print("Assistant: ", end="", flush=True)
-for response in stream_generate(model, tokenizer, prompt, max_tokens=512):
-    print(response.text, end="", flush=True)
-print()
\ No newline at end of file
+def load_model(checkpoint: str = DEFAULT_CHECKPOINT, bits=None, group_size: int = 64):
+    """Load a checkpoint and optionally quantize its weights in place.
+
+    `bits=None` (or 16) keeps the weights as stored. Quantizing needs an
+    unquantized checkpoint: the mlx-community 4-bit repos can't be requantized.
+    """
+    model, tokenizer = load(path_or_hf_repo=checkpoint)
+    if bits is not None and bits < 16:
+        if is_quantized(model):
+            raise ValueError(
+                f"{checkpoint} is already quantized; use an fp16/bf16 checkpoint to sweep bit-widths."
+            )
+        nn.quantize(
+            model,
+            group_size=group_size,
+            bits=bits,
+            # Layers whose input dim isn't a multiple of the group size stay in full precision
+            class_predicate=lambda _, m: hasattr(m, "to_quantized")
+            and m.weight.shape[-1] % group_size == 0,
+        )
+        mx.eval(model.parameters())
+    return model, tokenizer
+
+
+def normalize_messages(messages):
+    """Decode OpenAI-style string tool-call arguments for the chat template.
+
+    Clients send `function.arguments` as a JSON string; HF chat templates
+    serialize it again with `tojson`, so parse it back to a dict first.
+    """
+    normalized = []
+    for message in messages:
+        tool_calls = message.get("tool_calls")
+        if tool_calls:
+            message = dict(message, tool_calls=[])
+            for call in tool_calls:
+                function = dict(call.get("function", {}))
+                if isinstance(function.get("arguments"), str):
+                    try:
+                        function["arguments"] = json.loads(function["arguments"])
+                    except json.JSONDecodeError:
+                        pass
+                message["tool_calls"].append(dict(call, function=function))
+        normalized.append(message)
+    return normalized
+
+
+def build_prompt(tokenizer, messages, tools=None):
+    """Render chat messages (and optional tool schemas) to prompt token ids."""
+    return tokenizer.apply_chat_template(
+        normalize_messages(messages), tools=tools, add_generation_prompt=True
+    )
+
+
+def embed_text(model, tokenizer, text: str) -> np.ndarray:
+    """Unit-norm mean of the model's input token embeddings for `text`.
+
+    A cheap prompt embedding that needs no second model; good enough to match
+    near-verbatim repeats of a question.
+    """
+    embedding = next(
+        module
+        for _, module in model.named_modules()
+        if isinstance(module, (nn.Embedding, nn.QuantizedEmbedding))
+    )
+    vector = embedding(mx.array(tokenizer.encode(text))).astype(mx.float32).mean(axis=0)
+    vector = vector / mx.maximum(mx.linalg.norm(vector), 1e-6)
+    return np.array(vector)
+
+
+def generate(model, tokenizer, messages, max_tokens: int = 512, **kwargs):
+    """Stream a reply to `messages`.
+
+    Extra keyword arguments go straight to `mlx_lm.stream_generate`
+    (`sampler`, `prefill_step_size`, `kv_bits`, `kv_group_size`, ...).
+    Yields `GenerationResponse` objects, the last of which carries the
+    prompt/generation throughput and peak memory for the call.
+    """
+    prompt = build_prompt(tokenizer, messages)
+    yield from stream_generate(model, tokenizer, prompt, max_tokens=max_tokens, **kwargs)
+
+
+def main():
+    # Load the corresponding model and tokenizer
+    model, tokenizer = load_model(DEFAULT_CHECKPOINT)
+
+    # Specify the prompt and conversation history
+    prompt = "Write a story about Einstein"
+    messages = [{"role": "user", "content": prompt}]
+
+    # Generate the response using streaming:
+    print(f"User: {messages[0]['content']}\n")
+    print("Assistant: ", end="", flush=True)
+    for response in generate(model, tokenizer, messages, max_tokens=512):
+        print(response.text, end="", flush=True)
+    print()
+
+
+if __name__ == "__main__":
+    main()
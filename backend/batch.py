@@ -0,0 +1,82 @@
+"""Run a JSONL file of chat requests against the server (`cupertino batch`).
+
+Each input line is a JSON object with `messages` and optionally `id`,
+`tools`, `response_format`, `max_tokens` and `temperature`. Each output
+line holds the request `id` and either the full completion (`response`) or
+an `error`. Requests run concurrently over one pooled HTTP client, and
+results are written in input order.
+
+    cupertino batch requests.jsonl -o results.jsonl --concurrency 16
+"""
+
+import argparse
+import json
+import sys
+
+DEFAULT_MODEL = "mlx-community/Qwen2.5-7B-Instruct-1M-4bit"
+DEFAULT_BASE_URL = "http://localhost:10240/v1"
+PASSTHROUGH_FIELDS = ("tools", "tool_choice", "response_format", "max_tokens", "temperature", "top_p")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run a JSONL file of chat requests concurrently.")
+    parser.add_argument("input", help="JSONL file of requests, or '-' for stdin.")
+    parser.add_argument("-o", "--output", default="-", help="Where to write JSONL results (default: stdout).")
+    parser.add_argument("--model", default=DEFAULT_MODEL, help="Model for requests that don't name one.")
+    parser.add_argument("--base-url", default=DEFAULT_BASE_URL)
+    parser.add_argument("--api-key", default="not-needed")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--timeout", type=float, default=600.0, help="Per-request timeout in seconds.")
+    return parser.parse_args(argv)
+
+
+async def run_batch(requests, args):
+    import asyncio
+
+    from openai import AsyncOpenAI
+
+    client = AsyncOpenAI(base_url=args.base_url, api_key=args.api_key, timeout=args.timeout)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def run_one(index, request):
+        request_id = request.get("id", index)
+        params = {k: request[k] for k in PASSTHROUGH_FIELDS if k in request}
+        async with semaphore:
+            try:
+                completion = await client.chat.completions.create(
+                    model=request.get("model", args.model), messages=request["messages"], **params
+                )
+                return {"id": request_id, "response": completion.model_dump()}
+            except Exception as e:
+                return {"id": request_id, "error": f"{type(e).__name__}: {e}"}
+
+    try:
+        return await asyncio.gather(*(run_one(i, r) for i, r in enumerate(requests)))
+    finally:
+        await client.close()
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # asyncio and the SDK are imported only once there is work to do
+    import asyncio
+
+    source = sys.stdin if args.input == "-" else open(args.input)
+    with source:
+        requests = [json.loads(line) for line in source if line.strip()]
+    results = asyncio.run(run_batch(requests, args))
+
+    sink = sys.stdout if args.output == "-" else open(args.output, "w")
+    try:
+        for result in results:
+            sink.write(json.dumps(result) + "\n")
+    finally:
+        if sink is not sys.stdout:
+            sink.close()
+    failed = sum(1 for r in results if "error" in r)
+    print(f"{len(results) - failed}/{len(results)} requests succeeded.", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
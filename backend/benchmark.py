@@ -0,0 +1,353 @@
+"""Benchmark matrix for the app.py load/generate path.
+
+Sweeps weight bits, quantization group size, KV-cache bits, prefill chunk
+size and batch size over the fixed prompt corpus in benchmarks/prompts.json,
+plus one long prompt built from benchmarks/heldout.txt so that the prefill
+chunk size actually changes how the prompt is processed.
+Each configuration records prefill and decode tokens/sec, peak memory and
+perplexity on benchmarks/heldout.txt. Every configuration gets discarded
+warm-up passes and then `--repeats` measured passes, and the median of those
+is reported. The report is written as JSON and compared against a stored
+baseline; any regression beyond the tolerances makes the script exit
+non-zero so it can gate CI.
+
+Runs on CPU-only Linux (`pip install "mlx[cpu]" mlx-lm`) with a tiny model:
+
+    cupertino bench models --device cpu --baseline benchmarks/baseline.json
+    cupertino bench models --device cpu --baseline benchmarks/baseline.json --update-baseline
+"""
+
+import argparse
+import itertools
+import json
+import math
+import os
+import platform
+import statistics
+import sys
+import time
+
+import mlx.core as mx
+import mlx.nn as nn
+from mlx_lm import stream_generate
+
+from . import mlx_memory
+from .app import build_prompt, load_model
+
+# --- Configuration ---
+# Unquantized so the bit-width sweep can quantize it; small enough for CPU CI.
+DEFAULT_MODEL = "HuggingFaceTB/SmolLM2-135M-Instruct"
+BENCH_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks")
+DEFAULT_PROMPTS = os.path.join(BENCH_DIR, "prompts.json")
+DEFAULT_HELDOUT = os.path.join(BENCH_DIR, "heldout.txt")
+
+# Relative tolerances used when comparing against the baseline.
+DEFAULT_SPEED_TOLERANCE = 0.15  # tokens/sec may drop by up to 15%
+DEFAULT_MEMORY_TOLERANCE = 0.10  # peak memory may grow by up to 10%
+DEFAULT_PPL_TOLERANCE = 0.02  # perplexity may grow by up to 2%
+DEFAULT_MEMORY_FLOOR_GB = 0.05  # peak memory growth below this is noise, whatever the ratio
+DEFAULT_WARMUP = 1  # discarded passes per configuration
+DEFAULT_REPEATS = 5  # measured passes per configuration; the median is reported
+
+
+def _int_list(value):
+    return [int(v) for v in value.split(",") if v]
+
+
+def _optional_int_list(value):
+    """Parse '16,8,4' or 'none,8,4' -- 'none' means unquantized."""
+    return [None if v.lower() in ("none", "16") else int(v) for v in value.split(",") if v]
+
+
+def config_key(config: dict) -> str:
+    """Stable identifier used to match a result with its baseline entry."""
+    return ",".join(f"{k}={config[k]}" for k in sorted(config))
+
+
+def sweep(args):
+    """Yield every distinct configuration in the requested matrix."""
+    seen = set()
+    for bits, group_size, kv_bits, prefill, batch in itertools.product(
+        args.bits, args.group_sizes, args.kv_bits, args.prefill_chunks, args.batch_sizes
+    ):
+        config = {
+            "bits": bits,
+            # Group size only means something for quantized weights
+            "group_size": group_size if bits is not None else None,
+            "kv_bits": kv_bits,
+            "prefill_chunk": prefill,
+            "batch_size": batch,
+        }
+        key = config_key(config)
+        if key not in seen:
+            seen.add(key)
+            yield config
+
+
+# --- Measurements ---
+def perplexity(model, tokenizer, text: str, context: int = 512) -> float:
+    """Perplexity of `text` under `model`, evaluated in non-overlapping windows."""
+    tokens = tokenizer.encode(text)
+    if len(tokens) < 2:
+        raise ValueError(f"Perplexity needs at least 2 tokens of held-out text, got {len(tokens)}")
+    total_nll, total_tokens = 0.0, 0
+    for start in range(0, len(tokens) - 1, context):
+        window = tokens[start : start + context + 1]
+        if len(window) < 2:
+            break
+        inputs = mx.array(window[:-1])[None]
+        targets = mx.array(window[1:])[None]
+        logits = model(inputs).astype(mx.float32)
+        loss = nn.losses.cross_entropy(logits, targets, reduction="sum")
+        mx.eval(loss)
+        total_nll += loss.item()
+        total_tokens += targets.size
+    return math.exp(total_nll / total_tokens)
+
+
+def long_prompt(tokenizer, text: str, min_tokens: int) -> list:
+    """Prompt tokens of at least `min_tokens`: `text` repeated, then a question about it."""
+    repeats = 1
+    while True:
+        document = "\n\n".join([text.strip()] * repeats)
+        prompt = build_prompt(tokenizer, [{"role": "user", "content": f"{document}\n\nSummarize the text above in one sentence."}])
+        if len(prompt) >= min_tokens:
+            return prompt
+        repeats += 1
+
+
+def run_sequential(model, tokenizer, prompts, config, max_tokens, kv_group_size=64):
+    """Generate for each prompt one at a time through stream_generate."""
+    prompt_tokens = prompt_time = gen_tokens = gen_time = 0.0
+    kwargs = {"prefill_step_size": config["prefill_chunk"]}
+    if config["kv_bits"] is not None:
+        # Quantize from the first token; mlx_lm's default only starts at 5000
+        kwargs.update(kv_bits=config["kv_bits"], kv_group_size=kv_group_size, quantized_kv_start=0)
+    for prompt in prompts:
+        last = None
+        for last in stream_generate(model, tokenizer, prompt, max_tokens=max_tokens, **kwargs):
+            pass
+        prompt_tokens += last.prompt_tokens
+        prompt_time += last.prompt_tokens / max(last.prompt_tps, 1e-9)
+        gen_tokens += last.generation_tokens
+        gen_time += last.generation_tokens / max(last.generation_tps, 1e-9)
+    return {
+        "prefill_tps": prompt_tokens / max(prompt_time, 1e-9),
+        "decode_tps": gen_tokens / max(gen_time, 1e-9),
+        "prompt_tokens": int(prompt_tokens),
+        "generation_tokens": int(gen_tokens),
+    }
+
+
+def run_batched(model, tokenizer, prompts, config, max_tokens):
+    """Generate for the whole corpus with mlx_lm's batched generator."""
+    try:
+        from mlx_lm import batch_generate
+    except ImportError:
+        return {"skipped": "mlx_lm.batch_generate unavailable in this mlx-lm version"}
+    if config["kv_bits"] is not None:
+        return {"skipped": "quantized KV cache is not supported by batch_generate"}
+    response = batch_generate(
+        model,
+        tokenizer,
+        prompts,
+        max_tokens=max_tokens,
+        prefill_step_size=config["prefill_chunk"],
+        prefill_batch_size=config["batch_size"],
+        completion_batch_size=config["batch_size"],
+    )
+    stats = response.stats
+    return {
+        "prefill_tps": stats.prompt_tps,
+        "decode_tps": stats.generation_tps,
+        "prompt_tokens": stats.prompt_tokens,
+        "generation_tokens": stats.generation_tokens,
+    }
+
+
+def measure(model, tokenizer, prompts, config, args) -> dict:
+    """One pass over the corpus with `config`, including its peak memory."""
+    mlx_memory.clear_cache()
+    mlx_memory.reset_peak_memory()
+    if config["batch_size"] == 1:
+        metrics = run_sequential(model, tokenizer, prompts, config, args.max_tokens, args.kv_group_size)
+    else:
+        metrics = run_batched(model, tokenizer, prompts, config, args.max_tokens)
+    if "skipped" not in metrics:
+        metrics["peak_memory_gb"] = mlx_memory.peak_memory() / 1e9
+    return metrics
+
+
+def median_metrics(runs: list) -> dict:
+    """Per-metric median of repeated passes (token counts are identical across them)."""
+    metrics = dict(runs[0])
+    for metric in ("prefill_tps", "decode_tps", "peak_memory_gb"):
+        metrics[metric] = statistics.median(run[metric] for run in runs)
+    return metrics
+
+
+def run_matrix(args):
+    with open(args.prompts) as f:
+        corpus = json.load(f)
+    with open(args.heldout) as f:
+        heldout = f.read()
+
+    results = []
+    loaded = {}  # (bits, group_size) -> (model, tokenizer, load_s, ppl)
+    for config in sweep(args):
+        weights = (config["bits"], config["group_size"])
+        if weights not in loaded:
+            loaded.clear()  # keep a single model resident
+            mlx_memory.clear_cache()
+            start = time.perf_counter()
+            model, tokenizer = load_model(args.model, bits=config["bits"], group_size=config["group_size"] or 64)
+            load_s = time.perf_counter() - start
+            ppl = perplexity(model, tokenizer, heldout, context=args.ppl_context)
+            loaded[weights] = (model, tokenizer, load_s, ppl)
+        model, tokenizer, load_s, ppl = loaded[weights]
+        prompts = [build_prompt(tokenizer, messages) for messages in corpus]
+        if args.long_prompt_tokens:
+            prompts.append(long_prompt(tokenizer, heldout, args.long_prompt_tokens))
+
+        metrics = measure(model, tokenizer, prompts, config, args)
+        if "skipped" not in metrics:
+            # The first pass doubles as warm-up (compilation, allocator growth)
+            for _ in range(args.warmup - 1):
+                measure(model, tokenizer, prompts, config, args)
+            runs = [measure(model, tokenizer, prompts, config, args) for _ in range(args.repeats)]
+            metrics = median_metrics(runs)
+            metrics["repeats"] = args.repeats
+            metrics["perplexity"] = ppl
+            metrics["load_s"] = load_s
+        results.append({"key": config_key(config), "config": config, "metrics": metrics})
+        print(f"{config_key(config)}: {_format_metrics(metrics)}", file=sys.stderr)
+    return results
+
+
+def _format_metrics(metrics: dict) -> str:
+    if "skipped" in metrics:
+        return f"skipped ({metrics['skipped']})"
+    return (
+        f"prefill {metrics['prefill_tps']:.1f} tok/s, decode {metrics['decode_tps']:.1f} tok/s, "
+        f"peak {metrics['peak_memory_gb']:.3f} GB, ppl {metrics['perplexity']:.3f}"
+    )
+
+
+# --- Baseline comparison ---
+def compare(results, baseline, args):
+    """Return a list of human-readable regressions against `baseline`."""
+    previous = {entry["key"]: entry["metrics"] for entry in baseline.get("results", [])}
+    regressions = []
+    for entry in results:
+        old, new = previous.get(entry["key"]), entry["metrics"]
+        if old is None or "skipped" in old or "skipped" in new:
+            continue
+        for metric in ("prefill_tps", "decode_tps"):
+            if new[metric] < old[metric] * (1 - args.speed_tolerance):
+                regressions.append(f"{entry['key']}: {metric} {old[metric]:.1f} -> {new[metric]:.1f}")
+        growth = new["peak_memory_gb"] - old["peak_memory_gb"]
+        if new["peak_memory_gb"] > old["peak_memory_gb"] * (1 + args.memory_tolerance) and growth > args.memory_floor_gb:
+            regressions.append(
+                f"{entry['key']}: peak_memory_gb {old['peak_memory_gb']:.3f} -> {new['peak_memory_gb']:.3f}"
+            )
+        if new["perplexity"] > old["perplexity"] * (1 + args.ppl_tolerance):
+            regressions.append(f"{entry['key']}: perplexity {old['perplexity']:.3f} -> {new['perplexity']:.3f}")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark quantization and engine settings.")
+    parser.add_argument("--model", default=DEFAULT_MODEL, help="Unquantized checkpoint to sweep.")
+    parser.add_argument("--device", choices=["cpu", "gpu"], default=None, help="Force the MLX device.")
+    parser.add_argument("--bits", type=_optional_int_list, default=[None, 8, 4], help="Weight bits, e.g. none,8,4.")
+    parser.add_argument("--group-sizes", type=_int_list, default=[32, 64], help="Weight quantization group sizes.")
+    parser.add_argument("--kv-bits", type=_optional_int_list, default=[None, 8], help="KV cache bits, e.g. none,8,4.")
+    parser.add_argument("--kv-group-size", type=int, default=64, help="Group size for the quantized KV cache.")
+    parser.add_argument("--prefill-chunks", type=_int_list, default=[128, 512], help="Prefill chunk sizes.")
+    parser.add_argument("--batch-sizes", type=_int_list, default=[1, 4], help="Generation batch sizes.")
+    parser.add_argument("--max-tokens", type=int, default=32, help="Tokens to decode per prompt.")
+    parser.add_argument(
+        "--long-prompt-tokens",
+        type=int,
+        default=None,
+        help="Length of the prompt built from the held-out text (default: twice the largest prefill chunk; 0 omits it).",
+    )
+    parser.add_argument("--ppl-context", type=int, default=512, help="Window length for perplexity.")
+    parser.add_argument("--prompts", default=DEFAULT_PROMPTS, help="JSON list of message lists.")
+    parser.add_argument("--heldout", default=DEFAULT_HELDOUT, help="Held-out text for perplexity.")
+    parser.add_argument("--output", default="bench_report.json", help="Where to write the JSON report.")
+    parser.add_argument("--baseline", default=None, help="Baseline report to compare against.")
+    parser.add_argument("--update-baseline", action="store_true", help="Overwrite the baseline with this run.")
+    parser.add_argument("--speed-tolerance", type=float, default=DEFAULT_SPEED_TOLERANCE)
+    parser.add_argument("--memory-tolerance", type=float, default=DEFAULT_MEMORY_TOLERANCE)
+    parser.add_argument("--ppl-tolerance", type=float, default=DEFAULT_PPL_TOLERANCE)
+    parser.add_argument(
+        "--memory-floor-gb",
+        type=float,
+        default=DEFAULT_MEMORY_FLOOR_GB,
+        help="Peak-memory growth below this is never a regression.",
+    )
+    parser.add_argument("--warmup", type=int, default=DEFAULT_WARMUP, help="Discarded passes per configuration.")
+    parser.add_argument(
+        "--repeats", type=int, default=DEFAULT_REPEATS, help="Measured passes per configuration; the median is used."
+    )
+    args = parser.parse_args(argv)
+    if args.update_baseline and not args.baseline:
+        parser.error("--update-baseline needs --baseline PATH")
+    if args.baseline and not args.update_baseline and not os.path.exists(args.baseline):
+        parser.error(f"no baseline at {args.baseline}; run with --update-baseline to create one")
+    if args.warmup < 1 or args.repeats < 1:
+        parser.error("--warmup and --repeats must be at least 1")
+    if args.long_prompt_tokens is None:
+        args.long_prompt_tokens = 2 * max(args.prefill_chunks)
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.device == "cpu":
+        mx.set_default_device(mx.cpu)
+    elif args.device == "gpu":
+        mx.set_default_device(mx.gpu)
+
+    report = {
+        "meta": {
+            "model": args.model,
+            "device": str(mx.default_device()),
+            "platform": platform.platform(),
+            "mlx_version": getattr(mx, "__version__", "unknown"),
+            "max_tokens": args.max_tokens,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        },
+        "results": run_matrix(args),
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {args.output}", file=sys.stderr)
+
+    if not args.baseline:
+        return 0
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline updated: {args.baseline}", file=sys.stderr)
+        return 0
+    if not os.path.exists(args.baseline):
+        # Checked up front too; a gate must not pass because its baseline vanished mid-run
+        print(f"No baseline at {args.baseline}; run with --update-baseline to create one.", file=sys.stderr)
+        return 1
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get("meta", {}).get("device") != report["meta"]["device"]:
+        print("Warning: baseline was recorded on a different device.", file=sys.stderr)
+    regressions = compare(report["results"], baseline, args)
+    for line in regressions:
+        print(f"REGRESSION {line}", file=sys.stderr)
+    if regressions:
+        return 1
+    print("No regressions against baseline.", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
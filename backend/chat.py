@@ -0,0 +1,103 @@
+"""Plain streaming chat with the local server (`cupertino chat`)."""
+
+import argparse
+
+from .session_journal import DEFAULT_CONTEXT_BUDGET, resume, warm_prefix_cache
+
+DEFAULT_MODEL = "mlx-community/QwQ-32B-4bit"
+DEFAULT_BASE_URL = "http://localhost:10240/v1"  # Point to local server
+DEFAULT_MAX_TOKENS = 9000
+DIM, RESET = "\033[2m", "\033[0m"
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Streaming chat with a local OpenAI-compatible server.")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--base-url", default=DEFAULT_BASE_URL)
+    parser.add_argument("--api-key", default="not-needed")  # API key is not required for local server
+    parser.add_argument("--max-tokens", type=int, default=DEFAULT_MAX_TOKENS)
+    parser.add_argument(
+        "--reasoning-budget",
+        type=int,
+        default=None,
+        help="Cap on tokens spent inside <think>; the server then closes the block and answers.",
+    )
+    parser.add_argument("--show-reasoning", action="store_true", help="Print the model's thinking (dimmed).")
+    parser.add_argument("--session", default=None, help="Journal the conversation under this name and resume it.")
+    parser.add_argument(
+        "--context-budget",
+        type=int,
+        default=DEFAULT_CONTEXT_BUDGET,
+        help="Approximate tokens of history loaded when resuming a session.",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # Imported after argument parsing so `--help` and usage errors stay fast
+    from openai import OpenAI
+
+    client = OpenAI(base_url=args.base_url, api_key=args.api_key)
+
+    # Initialize conversation history
+    messages = []
+    if args.session:
+        messages = resume(args.session, args.context_budget)
+        if messages:
+            warm_prefix_cache(args.base_url, list(messages), model=args.model)
+            print(f"Resumed session '{args.session}' ({len(messages)} messages).")
+
+    print("Chat started. Type 'exit' or 'quit' to end.")
+
+    while True:
+        # Get user input
+        try:
+            user_input = input("You: ")
+        except (EOFError, KeyboardInterrupt):
+            print("\nExiting chat.")
+            break
+        if user_input.lower() in ["exit", "quit"]:
+            print("Exiting chat.")
+            break
+
+        # Add user message to history
+        messages.append({"role": "user", "content": user_input})
+
+        try:
+            chat_completion = client.chat.completions.create(
+                model=args.model,
+                messages=messages,  # Send the whole history
+                max_tokens=args.max_tokens,
+                stream=True,
+                # Server-side extensions; hidden reasoning isn't even sent over the wire
+                extra_body={"reasoning_budget": args.reasoning_budget, "include_reasoning": args.show_reasoning},
+            )
+
+            print("Assistant: ", end="", flush=True)
+            full_response = ""
+            for chunk in chat_completion:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                reasoning = getattr(delta, "reasoning_content", None)
+                if reasoning:
+                    print(f"{DIM}{reasoning}{RESET}", end="", flush=True)
+                content = delta.content
+                if content:
+                    print(content, end="", flush=True)
+                    full_response += content
+            print()  # Newline after the stream finishes
+
+            # Add assistant response to history
+            messages.append({"role": "assistant", "content": full_response})
+
+        except Exception as e:
+            print(f"An error occurred: {e}")
+            # Remove the last user message if the request failed
+            if messages and messages[-1]["role"] == "user":
+                messages.pop()
+
+
+if __name__ == "__main__":
+    main()
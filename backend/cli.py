@@ -0,0 +1,75 @@
+"""`cupertino` command-line entry point.
+
+    cupertino chat               streaming chat with the local server
+    cupertino tools-chat         multi-tool support agent
+    cupertino tools-demo         single-tool delivery-date chat
+    cupertino serve              OpenAI-compatible MLX server
+    cupertino batch FILE         run a JSONL file of requests concurrently
+    cupertino bench models       quantization / batching benchmark matrix
+    cupertino bench startup      CLI startup-time regression check
+    cupertino bench sse          streaming encoder / token coalescing throughput
+
+Each subcommand lives in its own module with a `main(argv)` function, and
+that module is imported only once the subcommand has been chosen. This file
+must stay free of third-party imports: `cupertino chat` should not pay for
+mlx or fastapi, and `cupertino --help` should pay for nothing at all.
+"""
+
+import argparse
+import importlib
+import sys
+
+COMMANDS = {
+    "chat": ("chat", "Streaming chat with the local server."),
+    "tools-chat": ("multi_tool_chat", "Customer-support agent with sandboxed tools."),
+    "tools-demo": ("interactive_tool_calling", "Delivery-date chat with a single tool."),
+    "serve": ("server", "Run the OpenAI-compatible MLX server."),
+    "batch": ("batch", "Run a JSONL file of chat requests concurrently."),
+}
+
+BENCH_SUITES = {
+    "models": ("benchmark", "Quantization, KV-cache and batching benchmark matrix."),
+    "startup": ("startup_bench", "CLI startup time and import-hygiene check."),
+    "sse": ("sse_bench", "Streaming chunk encoding and token coalescing throughput."),
+}
+
+
+def _format_table(entries: dict) -> str:
+    return "\n".join(f"  {name:<12} {summary}" for name, (_, summary) in entries.items())
+
+
+def _run(module_name: str, argv: list, prog: str):
+    module = importlib.import_module(f"{__package__}.{module_name}")
+    sys.argv = [prog, *argv]  # so the subcommand's usage line reads `cupertino <command>`
+    return module.main(argv)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="cupertino",
+        description="cupertino_ink command-line tools.",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="commands:\n" + _format_table(COMMANDS) + "\n  bench        Benchmarks; see `cupertino bench --help`."
+        "\n\nRun `cupertino <command> --help` for command options.",
+    )
+    parser.add_argument("command", choices=[*COMMANDS, "bench"], metavar="command")
+    parser.add_argument("args", nargs=argparse.REMAINDER, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.command != "bench":
+        return _run(COMMANDS[args.command][0], args.args, f"cupertino {args.command}")
+
+    bench = argparse.ArgumentParser(
+        prog="cupertino bench",
+        description="Benchmark suites.",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="suites:\n" + _format_table(BENCH_SUITES),
+    )
+    bench.add_argument("suite", choices=list(BENCH_SUITES), metavar="suite")
+    bench.add_argument("args", nargs=argparse.REMAINDER, help=argparse.SUPPRESS)
+    bench_args = bench.parse_args(args.args)
+    return _run(BENCH_SUITES[bench_args.suite][0], bench_args.args, f"cupertino bench {bench_args.suite}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
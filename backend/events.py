@@ -0,0 +1,31 @@
+"""Events a generation emits, shared by the scheduler and the HTTP layer.
+
+Kept free of MLX imports so the streaming code (`sse`, `cupertino bench
+sse`) can use them without loading the inference stack.
+"""
+
+from dataclasses import dataclass
+from typing import Optional
+
+
+@dataclass
+class PrefillProgress:
+    processed_tokens: int
+    total_tokens: int
+
+
+@dataclass
+class TokenEvent:
+    token: int
+    text: str
+    reasoning: bool = False  # part of the model's <think> block
+
+
+@dataclass
+class Finished:
+    finish_reason: str  # "stop", "length", "tool_calls", "cancelled" or "error"
+    prompt_tokens: int
+    completion_tokens: int
+    error: Optional[str] = None
+    cached_tokens: int = 0  # prompt tokens restored from the prefix cache
+    reasoning_tokens: int = 0  # completion tokens spent inside <think>
@@ -0,0 +1,48 @@
+"""Thin wrappers over MLX's memory APIs.
+
+Newer MLX releases expose these at the top level (``mx.get_peak_memory``);
+older ones only under ``mx.metal``. CPU-only Linux builds have the top-level
+functions, so the benchmark and server can run there too.
+"""
+
+import mlx.core as mx
+
+
+def _mx_fn(name):
+    fn = getattr(mx, name, None)
+    if fn is None:
+        fn = getattr(mx.metal, name)
+    return fn
+
+
+def active_memory() -> int:
+    """Bytes currently held by live arrays."""
+    return _mx_fn("get_active_memory")()
+
+
+def peak_memory() -> int:
+    """Highest active memory (bytes) since the last reset."""
+    return _mx_fn("get_peak_memory")()
+
+
+def reset_peak_memory() -> None:
+    _mx_fn("reset_peak_memory")()
+
+
+def cache_memory() -> int:
+    """Bytes held by MLX's buffer cache (freed arrays kept for reuse)."""
+    return _mx_fn("get_cache_memory")()
+
+
+def clear_cache() -> None:
+    _mx_fn("clear_cache")()
+
+
+def device_memory_limit():
+    """Recommended working-set size for the GPU in bytes, or None on CPU."""
+    try:
+        if mx.metal.is_available():
+            return mx.metal.device_info().get("max_recommended_working_set_size")
+    except AttributeError:
+        pass
+    return None
@@ -0,0 +1,149 @@
+"""Reusable KV caches for shared prompt prefixes.
+
+A multi-turn chat re-sends the whole conversation every turn, so each new
+prompt starts with the previous one. After a sequence finishes prefill, the
+scheduler snapshots its KV cache here, keyed by the prompt tokens it covers.
+A later prompt that shares a prefix with a stored entry starts from a copy
+of that cache and only prefills the remaining tokens.
+
+Snapshots are slices of the live cache arrays. MLX arrays are values, so
+the running sequence appending to its own cache never changes a snapshot.
+Only plain `KVCache` layers are supported; models with rotating or
+quantized caches simply bypass the prefix cache.
+
+Snapshots are bounded by count and by bytes. A snapshot is charged for
+the whole buffer it slices, because that is what it keeps alive. Admission
+control calls `evict` to hand memory back before it queues or rejects a
+request. The engine thread stores and restores, while the server's event
+loop reads `snapshot()`, so the entries are guarded by a lock.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from mlx_lm.models.cache import KVCache, make_prompt_cache
+
+DEFAULT_PREFIX_CACHE_SIZE = 4  # stored prefixes
+DEFAULT_MIN_PREFIX_TOKENS = 64  # shorter matches aren't worth a restore
+
+
+def _common_prefix(a: List[int], b: List[int]) -> int:
+    n = min(len(a), len(b))
+    for i in range(n):
+        if a[i] != b[i]:
+            return i
+    return n
+
+
+class PrefixCache:
+    """LRU of `(tokens, per-layer keys/values, nbytes)` snapshots."""
+
+    def __init__(
+        self,
+        model,
+        capacity: int = DEFAULT_PREFIX_CACHE_SIZE,
+        min_tokens: int = DEFAULT_MIN_PREFIX_TOKENS,
+        max_bytes: Optional[int] = None,
+    ):
+        """`max_bytes=None` bounds the cache by `capacity` entries only."""
+        self.model = model
+        self.capacity = capacity
+        self.min_tokens = min_tokens
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[int, Tuple[List[int], list, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.reused_tokens = 0
+        self.evicted_bytes = 0
+
+    @staticmethod
+    def supports(cache: list) -> bool:
+        return all(type(layer) is KVCache for layer in cache)
+
+    def store(self, tokens: List[int], cache: list):
+        """Snapshot `cache`, which must cover exactly `tokens`."""
+        if self.capacity <= 0 or len(tokens) < self.min_tokens or not self.supports(cache):
+            return
+        tokens = list(tokens)
+        # Slices share the live buffers, so the whole buffers stay resident
+        nbytes = sum(layer.keys.nbytes + layer.values.nbytes for layer in cache)
+        if self.max_bytes is not None and nbytes > self.max_bytes:
+            return
+        n = len(tokens)
+        layers = [(layer.keys[..., :n, :], layer.values[..., :n, :]) for layer in cache]
+        with self._lock:
+            for entry_id, (stored, _, _) in list(self._entries.items()):
+                # A longer prompt that extends an entry supersedes it
+                if len(stored) <= len(tokens) and tokens[: len(stored)] == stored:
+                    self._drop(entry_id)
+                elif len(stored) >= len(tokens) and stored[: len(tokens)] == tokens:
+                    self._entries.move_to_end(entry_id)
+                    return
+            self._entries[self._next_id] = (tokens, layers, nbytes)
+            self._next_id += 1
+            self.nbytes += nbytes
+            while len(self._entries) > self.capacity or (self.max_bytes is not None and self.nbytes > self.max_bytes):
+                self._drop(next(iter(self._entries)))
+
+    def _drop(self, entry_id: int) -> int:
+        _, _, nbytes = self._entries.pop(entry_id)
+        self.nbytes -= nbytes
+        return nbytes
+
+    def evict(self, nbytes: int) -> int:
+        """Drop least-recently-used entries until `nbytes` are freed (or none are left).
+
+        Returns the bytes released.
+        """
+        freed = 0
+        with self._lock:
+            while self._entries and freed < nbytes:
+                freed += self._drop(next(iter(self._entries)))
+            self.evicted_bytes += freed
+        return freed
+
+    def restore(self, prompt: List[int]) -> Tuple[Optional[list], int]:
+        """A fresh cache holding the longest stored prefix of `prompt`.
+
+        Returns `(cache, n_tokens)`, or `(None, 0)` on a miss. At most
+        `len(prompt) - 1` tokens are restored, since the last prompt token
+        has to be fed through the model to produce the first logits.
+        """
+        with self._lock:
+            best_id, best = None, 0
+            for entry_id, (tokens, _, _) in self._entries.items():
+                n = min(_common_prefix(tokens, prompt), len(prompt) - 1)
+                if n > best:
+                    best_id, best = entry_id, n
+            if best_id is None or best < self.min_tokens:
+                self.misses += 1
+                return None, 0
+            self._entries.move_to_end(best_id)
+            _, layers, _ = self._entries[best_id]
+        cache = make_prompt_cache(self.model)
+        if not self.supports(cache):
+            self.misses += 1
+            return None, 0
+        for layer, (keys, values) in zip(cache, layers):
+            layer.state = (keys[..., :best, :], values[..., :best, :], best)
+        self.hits += 1
+        self.reused_tokens += best
+        return cache, best
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "capacity": self.capacity,
+                "tokens": sum(len(tokens) for tokens, _, _ in self._entries.values()),
+                "bytes": self.nbytes,
+                "max_bytes": self.max_bytes,
+                "evicted_bytes": self.evicted_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "reused_tokens": self.reused_tokens,
+            }
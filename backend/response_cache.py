@@ -0,0 +1,300 @@
+"""Two-tier response cache for deterministic chat completions.
+
+Support traffic repeats itself ("Where is my package?"), so greedy
+(temperature 0) completions are cached and replayed instead of regenerated.
+
+* Exact tier: an in-memory LRU keyed on a hash of the normalized messages,
+  tools and sampling parameters.
+* Semantic tier (optional): a nearest-neighbour index over embeddings of the
+  final user message. Vectors live in a memory-mapped file on disk and entry
+  metadata in SQLite, with least-recently-used eviction at capacity. A match
+  must also share the exact hash of everything *before* the final user
+  message (system prompt, tools, earlier turns, sampling), so only the
+  question itself is matched fuzzily. The question's literals (anything with
+  a digit, e-mail addresses, capitalized names) must match exactly too: the
+  embedding can't tell "order ORD-123" from "order ORD-456", and a hit would
+  replay another customer's answer. Requests with `tools` never use this
+  tier, because a replayed tool call carries the original arguments.
+
+Entries store the streamed text segments as they were produced, so a replayed
+hit yields the same SSE chunks as the original generation.
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
+from typing import List, Optional
+
+import numpy as np
+
+DEFAULT_EXACT_CAPACITY = 1024
+DEFAULT_SEMANTIC_CAPACITY = 10000
+DEFAULT_SIMILARITY_THRESHOLD = 0.95
+_LAST_USED_BATCH = 256  # semantic hits buffered before their last-used times are written
+
+
+@dataclass
+class CachedResponse:
+    segments: List[str]
+    finish_reason: str
+    prompt_tokens: int
+    completion_tokens: int
+    extra: dict = field(default_factory=dict)
+    reasoning_segments: List[int] = field(default_factory=list)  # indices into `segments`
+    reasoning_tokens: int = 0
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self))
+
+    @classmethod
+    def from_json(cls, data: str):
+        return cls(**json.loads(data))
+
+
+# --- Keys ---
+def is_cacheable(temperature: float) -> bool:
+    """Only greedy decoding is reproducible enough to serve from cache."""
+    return temperature == 0
+
+
+def _normalize_text(text: str) -> str:
+    """Strip outer and trailing-line whitespace; newlines and indentation are content."""
+    return "\n".join(line.rstrip() for line in text.strip().splitlines())
+
+
+def _normalize_message(message: dict) -> dict:
+    normalized = {k: v for k, v in message.items() if v is not None}
+    content = normalized.get("content")
+    if isinstance(content, str):
+        normalized["content"] = _normalize_text(content)
+    return normalized
+
+
+def _digest(payload) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+
+def exact_key(messages, params: dict) -> str:
+    """Hash of normalized messages plus tools/sampling settings in `params`."""
+    return _digest({"messages": [_normalize_message(m) for m in messages], "params": params})
+
+
+def split_last_user_message(messages):
+    """(context messages, final user text) or None if the last turn isn't a user's."""
+    if not messages or messages[-1].get("role") != "user" or not isinstance(messages[-1].get("content"), str):
+        return None
+    return messages[:-1], _normalize_text(messages[-1]["content"])
+
+
+_NUMERIC_OR_EMAIL = re.compile(r"\S+@\S+\.\w+|[\w+-]*\d[\w.+-]*")
+_WORD = re.compile(r"[A-Za-z][\w'-]*")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+def question_literals(text: str) -> List[str]:
+    """Identifiers in `text` that a semantic match must reproduce exactly.
+
+    Tokens containing a digit (order numbers, dates, amounts), e-mail
+    addresses, and capitalized words other than the first of a sentence
+    (names, products). A heuristic: lower-case names slip through.
+    """
+    literals = {m.group(0).rstrip(".") for m in _NUMERIC_OR_EMAIL.finditer(text)}
+    for sentence in _SENTENCE_END.split(text):
+        words = _WORD.findall(sentence)
+        for i, word in enumerate(words):
+            if word[0].isupper() and i > 0 and word not in ("I", "I'm", "I've", "I'd", "I'll"):
+                literals.add(word)
+            elif any(ch.isupper() for ch in word[1:]):  # iPhone, ORD, McKinley
+                literals.add(word)
+    return sorted(literals)
+
+
+# --- Exact tier ---
+class ExactCache:
+    def __init__(self, capacity: int = DEFAULT_EXACT_CAPACITY):
+        self.capacity = capacity
+        self._entries = OrderedDict()
+        self.hits = self.misses = 0
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key: str, response: CachedResponse):
+        self._entries[key] = response
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# --- Semantic tier ---
+class SemanticIndex:
+    """On-disk nearest-neighbour index with LRU eviction.
+
+    `vectors.f32` is a (capacity, dim) memory-mapped matrix of unit vectors;
+    `index.sqlite` maps each slot to its context key, response and last use.
+    Last-use times from hits are buffered and written in one transaction,
+    before an eviction needs them or once enough have piled up, so a hit
+    doesn't pay for a commit.
+    """
+
+    def __init__(self, directory: str, dim: int, capacity: int = DEFAULT_SEMANTIC_CAPACITY,
+                 threshold: float = DEFAULT_SIMILARITY_THRESHOLD):
+        os.makedirs(directory, exist_ok=True)
+        self.dim = dim
+        self.capacity = capacity
+        self.threshold = threshold
+        self.hits = self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(directory, "index.sqlite"), check_same_thread=False)
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS entries (
+                slot INTEGER PRIMARY KEY, context_key TEXT NOT NULL,
+                response TEXT NOT NULL, last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS entries_context ON entries (context_key);
+            """
+        )
+        vectors_path = os.path.join(directory, "vectors.f32")
+        stored = dict(self._db.execute("SELECT key, value FROM meta").fetchall())
+        if stored != {"dim": str(dim), "capacity": str(capacity)}:
+            # Different embedding model or size: start over
+            self._db.execute("DELETE FROM entries")
+            self._db.execute("DELETE FROM meta")
+            self._db.executemany("INSERT INTO meta VALUES (?, ?)", [("dim", str(dim)), ("capacity", str(capacity))])
+            self._db.commit()
+            if os.path.exists(vectors_path):
+                os.remove(vectors_path)
+        mode = "r+" if os.path.exists(vectors_path) else "w+"
+        self._vectors = np.memmap(vectors_path, dtype=np.float32, mode=mode, shape=(capacity, dim))
+        self._last_used = {}  # slot -> time of a hit not yet written to SQLite
+        # context key -> slots, kept in memory so a lookup is one small matmul
+        self._slots = {}
+        for slot, context_key in self._db.execute("SELECT slot, context_key FROM entries"):
+            self._slots.setdefault(context_key, []).append(slot)
+
+    def search(self, context_key: str, vector: np.ndarray) -> Optional[CachedResponse]:
+        with self._lock:
+            slots = self._slots.get(context_key)
+            if slots:
+                scores = self._vectors[slots] @ vector
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    slot = slots[best]
+                    self._last_used[slot] = time.time()
+                    if len(self._last_used) >= _LAST_USED_BATCH:
+                        self._flush_last_used()
+                    row = self._db.execute("SELECT response FROM entries WHERE slot = ?", (slot,)).fetchone()
+                    self.hits += 1
+                    return CachedResponse.from_json(row[0])
+            self.misses += 1
+            return None
+
+    def add(self, context_key: str, vector: np.ndarray, response: CachedResponse):
+        with self._lock:
+            (count,) = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()
+            if count < self.capacity:
+                # Slots are only reused through eviction, so they fill in order
+                slot = count
+            else:
+                self._flush_last_used()  # eviction picks by last use
+                slot, old_key = self._db.execute(
+                    "SELECT slot, context_key FROM entries ORDER BY last_used LIMIT 1"
+                ).fetchone()
+                self._slots[old_key].remove(slot)
+                if not self._slots[old_key]:
+                    del self._slots[old_key]
+            self._vectors[slot] = vector
+            self._vectors.flush()
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                (slot, context_key, response.to_json(), time.time()),
+            )
+            self._db.commit()
+            self._slots.setdefault(context_key, []).append(slot)
+
+    def flush(self):
+        """Write buffered last-use times."""
+        with self._lock:
+            self._flush_last_used()
+
+    def _flush_last_used(self):
+        if self._last_used:
+            self._db.executemany("UPDATE entries SET last_used = ? WHERE slot = ?",
+                                 [(used, slot) for slot, used in self._last_used.items()])
+            self._db.commit()
+            self._last_used.clear()
+
+    def __len__(self):
+        return sum(len(slots) for slots in self._slots.values())
+
+
+# --- Facade used by the server ---
+class ResponseCache:
+    """Exact tier plus optional semantic tier.
+
+    `embed` maps text to a unit-norm float32 vector and may be a coroutine
+    function (the server computes embeddings on the engine thread).
+    """
+
+    def __init__(self, exact: ExactCache, semantic: Optional[SemanticIndex] = None, embed=None):
+        self.exact = exact
+        self.semantic = semantic
+        self.embed = embed
+
+    async def _embed(self, text: str) -> np.ndarray:
+        vector = self.embed(text)
+        if hasattr(vector, "__await__"):
+            vector = await vector
+        return vector
+
+    async def lookup(self, messages, params: dict):
+        """Return (cached response or None, opaque keys to pass to `store`)."""
+        key = exact_key(messages, params)
+        hit = self.exact.get(key)
+        if hit is not None or self.semantic is None or params.get("tools"):
+            return hit, (key, None, None)
+        split = split_last_user_message(messages)
+        if split is None:
+            return None, (key, None, None)
+        context, question = split
+        context_key = exact_key(context, dict(params, question_literals=question_literals(question)))
+        vector = await self._embed(question)
+        hit = self.semantic.search(context_key, vector)
+        if hit is not None:
+            # Promote so the next identical question skips the embedding
+            self.exact.put(key, hit)
+        return hit, (key, context_key, vector)
+
+    def store(self, keys, response: CachedResponse):
+        key, context_key, vector = keys
+        self.exact.put(key, response)
+        if self.semantic is not None and vector is not None:
+            self.semantic.add(context_key, vector, response)
+
+    def snapshot(self) -> dict:
+        stats = {"exact": {"entries": len(self.exact), "hits": self.exact.hits, "misses": self.exact.misses}}
+        if self.semantic is not None:
+            stats["semantic"] = {
+                "entries": len(self.semantic),
+                "hits": self.semantic.hits,
+                "misses": self.semantic.misses,
+                "threshold": self.semantic.threshold,
+            }
+        return stats
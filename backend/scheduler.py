@@ -0,0 +1,450 @@
+"""Generation scheduler with chunked prefill.
+
+One engine thread owns the model. Each loop iteration it advances every
+decoding sequence by one token, then feeds one prefill chunk to whichever
+prompt has waited longest for one (round robin). A very long prompt (the
+1M-context use case) is therefore processed `prefill_chunk_size` tokens at a
+time, with decode steps for the other active requests in between. Other
+users' streams keep moving, a short prompt that arrives mid-way gets its
+first token after a few chunks rather than after the whole document, and
+peak activation memory is bounded by the chunk size rather than the prompt
+length.
+
+A failure while serving one sequence (an exception from the model, an
+out-of-memory error during eval, a raising `stop_when`) ends that sequence
+with `Finished("error")`; the others carry on. If the engine thread itself
+has to stop, every active and pending request gets `Finished("error")`
+first, so no caller waits forever.
+
+Callers submit a `GenerationRequest` and receive `PrefillProgress`,
+`TokenEvent` and finally `Finished` events, either from a plain iterator
+(`stream`) or an async iterator (`astream`) for the HTTP server.
+
+With a `PrefixCache`, each finished sequence leaves a snapshot of its KV
+cache behind, and a new prompt sharing a prefix with one skips prefilling
+that part. A request with `max_tokens=0` only prefills and stores its
+prompt, which warms the cache for a conversation about to be resumed.
+
+For reasoning models (QwQ and other `<think>` templates), tokens inside the
+think block are flagged `reasoning=True` and counted separately. Once a
+request's `reasoning_budget` is spent, the scheduler drops the next sampled
+token, emits the tokens that close the block in its place and feeds them to
+the model as one chunk, and the model carries on with its answer. The
+closing tokens are not counted as reasoning, so `reasoning_tokens` never
+exceeds the budget.
+"""
+
+import asyncio
+import copy
+import queue
+import threading
+import uuid
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional
+
+import mlx.core as mx
+from mlx_lm.models.cache import make_prompt_cache
+from mlx_lm.sample_utils import make_sampler
+
+from . import mlx_memory
+from .events import Finished, PrefillProgress, TokenEvent
+from .prefix_cache import PrefixCache
+
+DEFAULT_PREFILL_CHUNK_SIZE = 512
+DEFAULT_MAX_ACTIVE = 8
+
+
+@dataclass
+class GenerationRequest:
+    prompt_tokens: List[int]
+    max_tokens: int = 512
+    temperature: float = 1.0
+    top_p: float = 1.0
+    request_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    # Called on the engine thread with each new text segment; returning a
+    # finish reason (e.g. "tool_calls") ends the sequence right there.
+    stop_when: Optional[Callable[[str], Optional[str]]] = None
+    # Maximum tokens inside <think>...</think> before the block is force-closed
+    reasoning_budget: Optional[int] = None
+
+
+class SequenceHandle:
+    """Caller's view of a submitted request."""
+
+    def __init__(self, request: GenerationRequest, on_event: Callable):
+        self.request = request
+        self.on_event = on_event
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class _Sequence:
+    """Per-request engine state; only touched by the scheduler thread."""
+
+    def __init__(
+        self,
+        handle: SequenceHandle,
+        model,
+        tokenizer,
+        prefix_cache: Optional[PrefixCache] = None,
+        thinking: bool = False,
+    ):
+        request = handle.request
+        self.handle = handle
+        self.prompt = request.prompt_tokens
+        self.decoding = False
+        self.next_input = None  # tokens fed to the model at the next decode step
+        self.generated = 0
+        self.output: List[int] = []
+        self.thinking = thinking  # currently inside a <think> block
+        self.reasoning_tokens = 0
+        self.prefill_turn = 0  # scheduler step at which this sequence last got a prefill chunk
+        self.cache, self.prefilled = prefix_cache.restore(self.prompt) if prefix_cache else (None, 0)
+        self.cached_tokens = self.prefilled
+        if self.cache is None:
+            self.cache = make_prompt_cache(model)
+        self.sampler = make_sampler(temp=request.temperature, top_p=request.top_p)
+        # The wrapper's detokenizer is shared, so every sequence gets its own copy
+        self.detokenizer = copy.copy(tokenizer.detokenizer)
+        self.detokenizer.reset()
+
+    def emit(self, event):
+        self.handle.on_event(event)
+
+
+class Scheduler:
+    def __init__(
+        self,
+        model,
+        tokenizer,
+        prefill_chunk_size: int = DEFAULT_PREFILL_CHUNK_SIZE,
+        max_active: int = DEFAULT_MAX_ACTIVE,
+        prefix_cache: Optional[PrefixCache] = None,
+    ):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.prefill_chunk_size = prefill_chunk_size
+        self.max_active = max_active
+        self.prefix_cache = prefix_cache
+        self.eos_token_ids = set(getattr(tokenizer, "eos_token_ids", None) or [tokenizer.eos_token_id])
+        self.think_start = list(getattr(tokenizer, "think_start_tokens", None) or [])
+        self.think_end = list(getattr(tokenizer, "think_end_tokens", None) or [])
+        self.think_markers = [m for m in (getattr(tokenizer, "think_start", None), getattr(tokenizer, "think_end", None)) if m]
+        # What a model writes when it finishes thinking on its own: "\n</think>\n\n"
+        self.think_close = (
+            list(tokenizer.encode("\n", add_special_tokens=False))
+            + self.think_end
+            + list(tokenizer.encode("\n\n", add_special_tokens=False))
+            if self.think_start and self.think_end
+            else []
+        )
+        self._pending = deque()
+        self._calls = deque()
+        self._active: List[_Sequence] = []
+        self._wakeup = threading.Condition()
+        self._stopped = False
+        self._failure = None  # why the engine thread died, if it did
+        self._steps = 0
+        self._thread = None
+
+    # --- Public API ---
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="generation-scheduler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        with self._wakeup:
+            self._stopped = True
+            self._wakeup.notify()
+        if self._thread is not None:
+            self._thread.join()
+
+    def submit(self, request: GenerationRequest, on_event: Callable) -> SequenceHandle:
+        """Queue `request`; `on_event` is called from the engine thread."""
+        if not request.prompt_tokens:
+            raise ValueError("prompt_tokens must not be empty")
+        handle = SequenceHandle(request, on_event)
+        with self._wakeup:
+            if not self._stopped:
+                self._pending.append(handle)
+                self._wakeup.notify()
+                return handle
+        on_event(Finished("error", len(request.prompt_tokens), 0, error=self._failure or "Scheduler is stopped"))
+        return handle
+
+    def call(self, fn) -> Future:
+        """Run `fn()` on the engine thread between steps.
+
+        Anything else that needs the model (e.g. embedding lookups for the
+        response cache) goes through here so MLX is only driven from one
+        thread.
+        """
+        future = Future()
+        with self._wakeup:
+            if not self._stopped:
+                self._calls.append((fn, future))
+                self._wakeup.notify()
+                return future
+        future.set_exception(RuntimeError(self._failure or "Scheduler is stopped"))
+        return future
+
+    def stream(self, request: GenerationRequest):
+        """Blocking iterator over the events of `request`."""
+        events = queue.Queue()
+        handle = self.submit(request, events.put)
+        try:
+            while True:
+                event = events.get()
+                yield event
+                if isinstance(event, Finished):
+                    return
+        finally:
+            handle.cancel()
+
+    async def astream(self, request: GenerationRequest):
+        """Async iterator over the events of `request`.
+
+        Closing the iterator early (e.g. the client disconnected) cancels the
+        sequence and frees its KV cache on the next scheduler iteration.
+        """
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+        handle = self.submit(request, lambda event: loop.call_soon_threadsafe(events.put_nowait, event))
+        try:
+            while True:
+                event = await events.get()
+                yield event
+                if isinstance(event, Finished):
+                    return
+        finally:
+            handle.cancel()
+
+    @property
+    def num_active(self) -> int:
+        return len(self._active)
+
+    @property
+    def num_pending(self) -> int:
+        return len(self._pending)
+
+    # --- Engine thread ---
+    @staticmethod
+    def _ends_with(tokens: List[int], suffix: List[int]) -> bool:
+        return bool(suffix) and tokens[-len(suffix) :] == suffix
+
+    @staticmethod
+    def _rfind(tokens: List[int], needle: List[int]) -> int:
+        for i in range(len(tokens) - len(needle), -1, -1):
+            if tokens[i : i + len(needle)] == needle:
+                return i
+        return -1
+
+    def _opens_thinking(self, prompt: List[int]) -> bool:
+        """Whether the prompt leaves the model inside a think block.
+
+        Templates like QwQ's end the generation prompt with an opening
+        `<think>`. Only the tail is searched, so long prompts stay cheap.
+        """
+        if not self.think_start:
+            return False
+        tail = prompt[-64:]
+        return self._rfind(tail, self.think_start) > self._rfind(tail, self.think_end)
+
+    def _run(self):
+        try:
+            # Streams are per thread in MLX; generate on one owned by this thread
+            with mx.stream(mx.new_stream(mx.default_device())):
+                self._loop()
+        except BaseException as e:
+            self._abort(f"Generation engine stopped: {e}")
+            raise
+        self._abort("Scheduler is stopped")
+
+    def _loop(self):
+        while True:
+            with self._wakeup:
+                while not self._stopped and not self._pending and not self._active and not self._calls:
+                    self._wakeup.wait()
+                if self._stopped:
+                    return
+                admitted = []
+                while self._pending and len(self._active) + len(admitted) < self.max_active:
+                    admitted.append(self._pending.popleft())
+                calls, self._calls = self._calls, deque()
+            for handle in admitted:
+                self._admit(handle)
+            for fn, future in calls:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(fn())
+                    except Exception as e:
+                        future.set_exception(e)
+            if self._active:
+                try:
+                    self._step()
+                except Exception as e:
+                    # Not attributable to one sequence; fail the ones in flight, keep serving
+                    for seq in list(self._active):
+                        self._finish(seq, "error", error=str(e))
+
+    def _admit(self, handle: SequenceHandle):
+        request = handle.request
+        try:
+            seq = _Sequence(
+                handle,
+                self.model,
+                self.tokenizer,
+                self.prefix_cache,
+                thinking=self._opens_thinking(request.prompt_tokens),
+            )
+        except Exception as e:
+            handle.on_event(Finished("error", len(request.prompt_tokens), 0, error=str(e)))
+            return
+        self._active.append(seq)
+
+    def _abort(self, error: str):
+        """Fail everything in flight or queued; no more work is accepted."""
+        with self._wakeup:
+            self._stopped = True
+            self._failure = error
+            pending, self._pending = list(self._pending), deque()
+            calls, self._calls = list(self._calls), deque()
+        for seq in list(self._active):
+            self._finish(seq, "error", error=error)
+        for handle in pending:
+            handle.on_event(Finished("error", len(handle.request.prompt_tokens), 0, error=error))
+        for _, future in calls:
+            if future.set_running_or_notify_cancel():
+                future.set_exception(RuntimeError(error))
+
+    def _step(self):
+        for seq in list(self._active):
+            if seq.handle.cancelled:
+                self._finish(seq, "cancelled")
+
+        decoding = [seq for seq in self._active if seq.decoding]
+        if decoding:
+            self._decode(decoding)
+
+        # One prefill chunk per iteration, to the prompt that waited longest for
+        # one (new arrivals first), so a huge prompt can't hold up short ones
+        self._steps += 1
+        prefilling = min((seq for seq in self._active if not seq.decoding), key=lambda s: s.prefill_turn, default=None)
+        if prefilling is not None:
+            prefilling.prefill_turn = self._steps
+            try:
+                self._prefill_chunk(prefilling)
+            except Exception as e:
+                self._finish(prefilling, "error", error=str(e))
+
+    def _prefill_chunk(self, seq: _Sequence):
+        total = len(seq.prompt)
+        # The last prompt token is fed by the first decode step so its logits
+        # produce the first sampled token.
+        end = min(seq.prefilled + self.prefill_chunk_size, total - 1)
+        if end > seq.prefilled:
+            self.model(mx.array(seq.prompt[seq.prefilled : end])[None], cache=seq.cache)
+            mx.eval([c.state for c in seq.cache])
+            seq.prefilled = end
+            mlx_memory.clear_cache()
+        if seq.prefilled >= total - 1:
+            seq.prefilled = total
+            seq.next_input = seq.prompt[-1:]
+            seq.decoding = True
+        seq.emit(PrefillProgress(seq.prefilled, total))
+        if seq.decoding and seq.handle.request.max_tokens <= 0:
+            self._finish(seq, "length")  # prefill-only (cache warm-up) request
+
+    def _decode(self, sequences: List[_Sequence]):
+        # Build every sequence's graph first so one eval covers them all
+        sampled = []
+        for seq in sequences:
+            try:
+                logits = self.model(mx.array([seq.next_input]), cache=seq.cache)[:, -1, :]
+                logprobs = logits - mx.logsumexp(logits, keepdims=True)
+                sampled.append((seq, seq.sampler(logprobs)))
+            except Exception as e:
+                self._finish(seq, "error", error=str(e))
+        if not sampled:
+            return
+        try:
+            mx.eval([token for _, token in sampled])
+        except Exception as e:  # e.g. out of memory; every sequence in the batch is lost
+            for seq, _ in sampled:
+                self._finish(seq, "error", error=str(e))
+            return
+
+        for seq, token in sampled:
+            try:
+                self._advance(seq, token.item())
+            except Exception as e:
+                self._finish(seq, "error", error=str(e))
+
+    def _advance(self, seq: _Sequence, token: int):
+        """Record one sampled token for `seq` and emit it."""
+        request = seq.handle.request
+        budget = request.reasoning_budget
+        forced = seq.thinking and budget is not None and seq.reasoning_tokens >= budget and bool(self.think_close)
+        # Out of budget: the sampled token is dropped and the closing sequence goes in instead
+        tokens = self.think_close[: request.max_tokens - seq.generated] if forced else [token]
+        for token in tokens:
+            seq.generated += 1
+            seq.output.append(token)
+            if token in self.eos_token_ids:
+                self._finish(seq, "stop")
+                return
+            seq.detokenizer.add_token(token)
+            text = seq.detokenizer.last_segment
+            reasoning = seq.thinking
+            if not seq.thinking and self._ends_with(seq.output, self.think_start):
+                seq.thinking = reasoning = True
+            elif seq.thinking and self._ends_with(seq.output, self.think_end):
+                seq.thinking = False
+            if reasoning:
+                if not forced:
+                    seq.reasoning_tokens += 1
+                for marker in self.think_markers:
+                    text = text.replace(marker, "")
+            seq.emit(TokenEvent(token, text, reasoning=reasoning))
+            reason = request.stop_when(text) if request.stop_when is not None and text and not reasoning else None
+            if reason:
+                self._finish(seq, reason)
+                return
+        if seq.generated >= request.max_tokens:
+            self._finish(seq, "length")
+        else:
+            seq.next_input = tokens  # a forced close is fed back as one chunk
+
+    def _finish(self, seq: _Sequence, reason: str, error: Optional[str] = None):
+        if seq not in self._active:
+            return
+        self._active.remove(seq)
+        if reason in ("stop", "length", "tool_calls"):
+            # Runs after the sequence left `_active`, so it must not raise past here
+            try:
+                if self.prefix_cache is not None:
+                    # The cache covers the prompt plus every generated token fed back in
+                    fed = seq.cache[0].offset if seq.cache else 0
+                    self.prefix_cache.store((seq.prompt + seq.output)[:fed], seq.cache)
+                seq.detokenizer.finalize()
+                tail = seq.detokenizer.last_segment
+                if tail:
+                    seq.emit(TokenEvent(-1, tail, reasoning=seq.thinking))
+            except Exception as e:
+                reason, error = "error", str(e)
+        seq.cache = None
+        seq.emit(
+            Finished(
+                reason,
+                len(seq.prompt),
+                seq.generated,
+                error=error,
+                cached_tokens=seq.cached_tokens,
+                reasoning_tokens=seq.reasoning_tokens,
+            )
+        )
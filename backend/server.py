@@ -0,0 +1,543 @@
+"""OpenAI-compatible chat completions server on top of the app.py engine.
+
+Serves `/v1/chat/completions` (streaming and non-streaming) from a single
+loaded model. Generation goes through `scheduler.Scheduler`, so long
+prompts are prefilled in chunks while other requests keep decoding.
+
+Requests pass through `admission.AdmissionController` first. Anything that
+would push memory past the high watermark is queued, and requests that
+cannot be served soon get a 429 with `Retry-After`. Queue depth, wait
+times and live/peak memory are at `GET /v1/admission/stats`.
+
+Greedy (temperature 0) requests are looked up in `response_cache` first;
+hits are replayed through the same SSE path, so clients see identical
+chunks. Cache statistics are at `GET /v1/cache/stats`.
+
+Every finished generation leaves its KV cache in a `PrefixCache`, so the
+next turn of a conversation only prefills the new messages. Clients
+resuming a journaled session can `POST /v1/prefix_cache/warm` with the
+history to prefill it before the user's next message arrives. Reused tokens
+are reported as `usage.prompt_tokens_details.cached_tokens`. The cache is
+capped at `--prefix-cache-gb`, and admission control evicts from it before it
+queues or rejects a request.
+
+When the request has `tools`, generated text is scanned for the model's
+tool-call markup (`<tool_call>`, `<|python_tag|>` or `[TOOL_CALLS]`, see
+`tool_parsing`). Decoding stops as soon as the call payload closes, and the
+reply carries structured `tool_calls` with `finish_reason: "tool_calls"`.
+`parallel_tool_calls: false` stops after the first call.
+
+For thinking models, the `<think>` block streams as `delta.reasoning_content`
+rather than `content` (`include_reasoning: false` drops it server-side).
+`reasoning_budget` caps the tokens spent thinking, and
+`usage.completion_tokens_details` splits reasoning from answer tokens.
+
+Streamed chunks are built by `sse.ChunkEncoder`, which splices each delta
+into a pre-serialized envelope. Under load, consecutive tokens are merged
+into one chunk: once `--stream-coalesce-min-streams` streams are open, a
+token may wait up to `--stream-coalesce-ms` for the next one (see
+`sse.coalesce`).
+
+Clients that want prefill progress opt in with
+`stream_options: {"include_prefill_progress": true}`; progress is then sent
+as chunks with an empty `choices` list and a `prefill_progress` object,
+the same shape OpenAI uses for the `include_usage` chunk.
+
+    cupertino serve --model mlx-community/Qwen2.5-7B-Instruct-1M-4bit --port 10240
+"""
+
+import argparse
+import asyncio
+import json
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+import uvicorn
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel
+from starlette.background import BackgroundTask
+
+from . import mlx_memory
+from .admission import (
+    DEFAULT_HIGH_WATERMARK,
+    DEFAULT_MAX_QUEUE_DEPTH,
+    DEFAULT_MAX_QUEUE_WAIT,
+    DEFAULT_REJECT_WATERMARK,
+    AdmissionController,
+    AdmissionRejected,
+    MemoryEstimator,
+)
+from .app import DEFAULT_CHECKPOINT, build_prompt, embed_text, load_model
+from .events import Finished, PrefillProgress, TokenEvent
+from .prefix_cache import DEFAULT_PREFIX_CACHE_SIZE, PrefixCache
+from .response_cache import (
+    DEFAULT_EXACT_CAPACITY,
+    DEFAULT_SEMANTIC_CAPACITY,
+    DEFAULT_SIMILARITY_THRESHOLD,
+    CachedResponse,
+    ExactCache,
+    ResponseCache,
+    SemanticIndex,
+    is_cacheable,
+)
+from .scheduler import DEFAULT_MAX_ACTIVE, DEFAULT_PREFILL_CHUNK_SIZE, GenerationRequest, Scheduler
+from .sse import DEFAULT_COALESCE_MIN_STREAMS, DEFAULT_COALESCE_MS, DEFAULT_COALESCE_TOKENS, ChunkEncoder, coalesce
+from .tool_parsing import ToolCallDetector, detect_tool_call_format
+
+DEFAULT_MAX_TOKENS = 512
+
+
+# --- Request schema ---
+class ChatCompletionRequest(BaseModel):
+    model: Optional[str] = None
+    messages: List[Dict[str, Any]]
+    tools: Optional[List[Dict[str, Any]]] = None
+    tool_choice: Optional[Any] = None
+    # Whether the model may return several tool calls in one turn. When false,
+    # generation stops at the first complete call.
+    parallel_tool_calls: bool = True
+    # Cap on tokens inside <think>...</think>; the block is force-closed after it
+    reasoning_budget: Optional[int] = None
+    include_reasoning: bool = True
+    stream: bool = False
+    stream_options: Optional[Dict[str, Any]] = None
+    temperature: float = 1.0
+    top_p: float = 1.0
+    max_tokens: Optional[int] = None
+
+
+def _sse(payload) -> str:
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+def _rejected(e: AdmissionRejected) -> JSONResponse:
+    return JSONResponse(
+        status_code=e.status_code,
+        content={
+            "error": {
+                "message": e.message,
+                "type": "rate_limit_error" if e.status_code == 429 else "invalid_request_error",
+            }
+        },
+        headers={"Retry-After": str(int(e.retry_after))} if e.retry_after else None,
+    )
+
+
+async def _replay(cached: CachedResponse):
+    """Serve a cache hit as the event sequence the scheduler produced for it."""
+    reasoning = set(cached.reasoning_segments)
+    for i, segment in enumerate(cached.segments):
+        yield TokenEvent(-1, segment, reasoning=i in reasoning)
+    yield Finished(
+        cached.finish_reason, cached.prompt_tokens, cached.completion_tokens, reasoning_tokens=cached.reasoning_tokens
+    )
+
+
+async def _record(events, response_cache: ResponseCache, cache_keys):
+    """Pass events through, storing completed generations in the cache."""
+    segments, reasoning_segments = [], []
+    try:
+        async for event in events:
+            if isinstance(event, TokenEvent) and event.text:
+                if event.reasoning:
+                    reasoning_segments.append(len(segments))
+                segments.append(event.text)
+            elif isinstance(event, Finished) and event.finish_reason in ("stop", "length", "tool_calls"):
+                response_cache.store(
+                    cache_keys,
+                    CachedResponse(
+                        segments,
+                        event.finish_reason,
+                        event.prompt_tokens,
+                        event.completion_tokens,
+                        reasoning_segments=reasoning_segments,
+                        reasoning_tokens=event.reasoning_tokens,
+                    ),
+                )
+            yield event
+    finally:
+        await events.aclose()
+
+
+def _tool_call_detector(body: ChatCompletionRequest, tool_format: Optional[str]) -> Optional[ToolCallDetector]:
+    if not body.tools or tool_format is None or body.tool_choice == "none":
+        return None
+    return ToolCallDetector(tool_format, parallel_tool_calls=body.parallel_tool_calls)
+
+
+def _tool_call_result(detector: Optional[ToolCallDetector], finished: Finished, parallel_tool_calls: bool):
+    """`(tool_calls, trailing_content, finish_reason)` once generation has ended."""
+    if detector is None:
+        return [], "", finished.finish_reason
+    tool_calls = detector.tool_calls()
+    if not tool_calls:
+        # Unparseable markup is passed through so clients can still inspect it
+        return [], detector.flush() + detector.markup, "stop" if finished.finish_reason == "tool_calls" else finished.finish_reason
+    if not parallel_tool_calls:
+        tool_calls = tool_calls[:1]
+    return tool_calls, "", "tool_calls"
+
+
+def create_app(
+    scheduler: Scheduler,
+    model_name: str,
+    admission: AdmissionController,
+    response_cache: Optional[ResponseCache] = None,
+    stream_coalesce_ms: float = DEFAULT_COALESCE_MS,
+    stream_coalesce_tokens: int = DEFAULT_COALESCE_TOKENS,
+    stream_coalesce_min_streams: int = DEFAULT_COALESCE_MIN_STREAMS,
+) -> FastAPI:
+    app = FastAPI(title="cupertino_ink backend")
+    tokenizer = scheduler.tokenizer
+    tool_format = detect_tool_call_format(tokenizer)
+
+    def _generation_request(body: ChatCompletionRequest) -> GenerationRequest:
+        try:
+            prompt_tokens = build_prompt(tokenizer, body.messages, tools=body.tools)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Could not apply chat template: {e}")
+        # The scheduler gets its own detector; it runs on the engine thread
+        stop_detector = _tool_call_detector(body, tool_format)
+        return GenerationRequest(
+            prompt_tokens=prompt_tokens,
+            max_tokens=body.max_tokens or DEFAULT_MAX_TOKENS,
+            temperature=body.temperature,
+            top_p=body.top_p,
+            stop_when=stop_detector.check if stop_detector is not None else None,
+            reasoning_budget=body.reasoning_budget,
+        )
+
+    @app.get("/v1/models")
+    async def list_models():
+        return {"object": "list", "data": [{"id": model_name, "object": "model", "owned_by": "local"}]}
+
+    @app.get("/v1/admission/stats")
+    async def admission_stats():
+        return dict(
+            admission.snapshot(),
+            scheduler={"active": scheduler.num_active, "pending": scheduler.num_pending},
+        )
+
+    @app.get("/v1/cache/stats")
+    async def cache_stats():
+        stats = response_cache.snapshot() if response_cache is not None else {}
+        if scheduler.prefix_cache is not None:
+            stats = dict(stats, prefix=scheduler.prefix_cache.snapshot())
+        return stats
+
+    @app.post("/v1/prefix_cache/warm")
+    async def warm_prefix_cache(body: ChatCompletionRequest):
+        if scheduler.prefix_cache is None:
+            raise HTTPException(status_code=404, detail="Prefix cache is disabled")
+        request = _generation_request(body)
+        request.max_tokens = 0  # prefill only
+        finished = None
+        try:
+            reservation = await admission.acquire(len(request.prompt_tokens), 0)
+        except AdmissionRejected as e:
+            return _rejected(e)
+        try:
+            async for event in scheduler.astream(request):
+                if isinstance(event, Finished):
+                    finished = event
+        finally:
+            reservation.release()
+        if finished.finish_reason == "error":
+            raise HTTPException(status_code=500, detail=finished.error)
+        return {"prompt_tokens": finished.prompt_tokens, "cached_tokens": finished.cached_tokens}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(body: ChatCompletionRequest):
+        max_tokens = body.max_tokens or DEFAULT_MAX_TOKENS
+        cached, cache_keys = None, None
+        if response_cache is not None and is_cacheable(body.temperature):
+            params = {
+                "model": model_name,
+                "tools": body.tools,
+                "tool_choice": body.tool_choice,
+                "parallel_tool_calls": body.parallel_tool_calls,
+                "reasoning_budget": body.reasoning_budget,
+                "temperature": body.temperature,
+                "top_p": body.top_p,
+                "max_tokens": max_tokens,
+            }
+            cached, cache_keys = await response_cache.lookup(body.messages, params)
+
+        if cached is not None:
+            events, release = _replay(cached), None
+        else:
+            request = _generation_request(body)
+            try:
+                reservation = await admission.acquire(len(request.prompt_tokens), request.max_tokens)
+            except AdmissionRejected as e:
+                return _rejected(e)
+            events, release = scheduler.astream(request), reservation.release
+            if cache_keys is not None:
+                events = _record(events, response_cache, cache_keys)
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        if body.stream:
+            # Released by the generator when it finishes; the background task
+            # covers a client that disconnects before the body starts.
+            return StreamingResponse(
+                _stream_completion(
+                    coalesce(events, stream_coalesce_ms, stream_coalesce_tokens, stream_coalesce_min_streams),
+                    body,
+                    completion_id,
+                    created,
+                    model_name,
+                    release,
+                    _tool_call_detector(body, tool_format),
+                ),
+                media_type="text/event-stream",
+                background=BackgroundTask(release) if release else None,
+            )
+
+        detector = _tool_call_detector(body, tool_format)
+        text, reasoning, finished = "", "", None
+        try:
+            async for event in events:
+                if isinstance(event, TokenEvent) and event.reasoning:
+                    reasoning += event.text
+                elif isinstance(event, TokenEvent):
+                    text += detector.feed(event.text) if detector else event.text
+                elif isinstance(event, Finished):
+                    finished = event
+        finally:
+            if release:
+                release()
+        if finished.finish_reason == "error":
+            raise HTTPException(status_code=500, detail=finished.error)
+        tool_calls, trailing, finish_reason = _tool_call_result(detector, finished, body.parallel_tool_calls)
+        message = {"role": "assistant", "content": (text + trailing) or (None if tool_calls else "")}
+        if tool_calls:
+            message["tool_calls"] = tool_calls
+        if reasoning and body.include_reasoning:
+            message["reasoning_content"] = reasoning
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model_name,
+            "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+            "usage": _usage(finished),
+        }
+
+    return app
+
+
+def _usage(finished: Finished) -> dict:
+    return {
+        "prompt_tokens": finished.prompt_tokens,
+        "completion_tokens": finished.completion_tokens,
+        "total_tokens": finished.prompt_tokens + finished.completion_tokens,
+        "prompt_tokens_details": {"cached_tokens": finished.cached_tokens},
+        "completion_tokens_details": {
+            "reasoning_tokens": finished.reasoning_tokens,
+            "answer_tokens": finished.completion_tokens - finished.reasoning_tokens,
+        },
+    }
+
+
+async def _stream_completion(events, body, completion_id, created, model_name, release, detector=None):
+    stream_options = body.stream_options or {}
+    include_progress = stream_options.get("include_prefill_progress", False)
+    include_usage = stream_options.get("include_usage", False)
+
+    encoder = ChunkEncoder(completion_id, created, model_name)
+    chunk = encoder.chunk
+
+    yield _sse(chunk({"role": "assistant", "content": ""}))
+    try:
+        async for event in events:
+            if isinstance(event, PrefillProgress):
+                if include_progress:
+                    yield _sse(
+                        dict(
+                            chunk(None),
+                            choices=[],
+                            prefill_progress={
+                                "processed_tokens": event.processed_tokens,
+                                "total_tokens": event.total_tokens,
+                            },
+                        )
+                    )
+            elif isinstance(event, TokenEvent) and event.reasoning:
+                if event.text and body.include_reasoning:
+                    yield encoder.delta("reasoning_content", event.text)
+            elif isinstance(event, TokenEvent):
+                text = detector.feed(event.text) if detector else event.text
+                if text:
+                    yield encoder.delta("content", text)
+            elif isinstance(event, Finished):
+                if event.finish_reason == "error":
+                    yield _sse({"error": {"message": event.error, "type": "server_error"}})
+                else:
+                    tool_calls, trailing, finish_reason = _tool_call_result(detector, event, body.parallel_tool_calls)
+                    if trailing:
+                        yield _sse(chunk({"content": trailing}))
+                    if tool_calls:
+                        yield _sse(chunk({"tool_calls": [dict(call, index=i) for i, call in enumerate(tool_calls)]}))
+                    yield _sse(chunk({}, finish_reason=finish_reason))
+                    if include_usage:
+                        yield _sse(dict(chunk(None), choices=[], usage=_usage(event)))
+    finally:
+        if release:
+            release()
+    yield "data: [DONE]\n\n"
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a local MLX model over an OpenAI-compatible API.")
+    parser.add_argument("--model", default=DEFAULT_CHECKPOINT)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=10240)
+    parser.add_argument(
+        "--prefill-chunk-size",
+        type=int,
+        default=DEFAULT_PREFILL_CHUNK_SIZE,
+        help="Prompt tokens processed per scheduler step; bounds activation memory.",
+    )
+    parser.add_argument(
+        "--max-active", type=int, default=DEFAULT_MAX_ACTIVE, help="Sequences decoded concurrently."
+    )
+    parser.add_argument(
+        "--prefix-cache-size",
+        type=int,
+        default=DEFAULT_PREFIX_CACHE_SIZE,
+        help="Conversation KV caches kept for prefix reuse (0 disables).",
+    )
+    parser.add_argument(
+        "--prefix-cache-gb",
+        type=float,
+        default=None,
+        help="Memory the prefix cache may hold (default: a quarter of the admission budget).",
+    )
+    parser.add_argument(
+        "--memory-limit-gb",
+        type=float,
+        default=None,
+        help="Memory budget for admission (default: GPU working set, else physical RAM).",
+    )
+    parser.add_argument(
+        "--high-watermark",
+        type=float,
+        default=DEFAULT_HIGH_WATERMARK,
+        help="Fraction of the budget above which new requests queue.",
+    )
+    parser.add_argument(
+        "--reject-watermark",
+        type=float,
+        default=DEFAULT_REJECT_WATERMARK,
+        help="Fraction of the budget above which new requests are rejected outright.",
+    )
+    parser.add_argument("--max-queue-depth", type=int, default=DEFAULT_MAX_QUEUE_DEPTH)
+    parser.add_argument(
+        "--max-queue-wait", type=float, default=DEFAULT_MAX_QUEUE_WAIT, help="Seconds a request may wait queued."
+    )
+    parser.add_argument(
+        "--response-cache-size",
+        type=int,
+        default=DEFAULT_EXACT_CAPACITY,
+        help="Exact-match cache entries for temperature-0 requests (0 disables caching).",
+    )
+    parser.add_argument(
+        "--semantic-cache-dir", default=None, help="Enable the nearest-neighbour cache tier, stored here."
+    )
+    parser.add_argument("--semantic-cache-capacity", type=int, default=DEFAULT_SEMANTIC_CAPACITY)
+    parser.add_argument(
+        "--semantic-threshold",
+        type=float,
+        default=DEFAULT_SIMILARITY_THRESHOLD,
+        help="Minimum cosine similarity for a semantic cache hit.",
+    )
+    parser.add_argument(
+        "--stream-coalesce-ms",
+        type=float,
+        default=DEFAULT_COALESCE_MS,
+        help="Longest a streamed token may be held back to share a chunk with the next ones.",
+    )
+    parser.add_argument(
+        "--stream-coalesce-tokens",
+        type=int,
+        default=DEFAULT_COALESCE_TOKENS,
+        help="Most tokens merged into one streamed chunk (1 sends every token on its own).",
+    )
+    parser.add_argument(
+        "--stream-coalesce-min-streams",
+        type=int,
+        default=DEFAULT_COALESCE_MIN_STREAMS,
+        help="Open streams before a token is held back to wait for the next one; below this only queued tokens are merged.",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    model, tokenizer = load_model(args.model)
+    admission = AdmissionController(
+        MemoryEstimator.from_model(model, args.prefill_chunk_size),
+        memory_limit=int(args.memory_limit_gb * 1e9) if args.memory_limit_gb else None,
+        high_watermark=args.high_watermark,
+        reject_watermark=args.reject_watermark,
+        max_queue_depth=args.max_queue_depth,
+        max_queue_wait=args.max_queue_wait,
+    )
+    prefix_cache = None
+    if args.prefix_cache_size > 0:
+        max_bytes = int(args.prefix_cache_gb * 1e9) if args.prefix_cache_gb is not None else admission.high_bytes // 4
+        prefix_cache = PrefixCache(model, args.prefix_cache_size, max_bytes=max_bytes)
+    scheduler = Scheduler(
+        model,
+        tokenizer,
+        prefill_chunk_size=args.prefill_chunk_size,
+        max_active=args.max_active,
+        prefix_cache=prefix_cache,
+    )
+    if prefix_cache is not None:
+
+        def evict(nbytes):
+            freed = prefix_cache.evict(nbytes)
+            mlx_memory.clear_cache()
+            return freed
+
+        # Snapshots are rebuilt on demand; admission frees them before queueing anyone.
+        # Eviction runs on the engine thread, which owns MLX.
+        admission.reclaim = lambda nbytes: asyncio.wrap_future(scheduler.call(lambda: evict(nbytes)))
+
+    response_cache = None
+    if args.response_cache_size > 0:
+        semantic = None
+        if args.semantic_cache_dir:
+            dim = embed_text(model, tokenizer, "dimension probe").shape[0]
+            semantic = SemanticIndex(
+                args.semantic_cache_dir, dim, capacity=args.semantic_cache_capacity, threshold=args.semantic_threshold
+            )
+        response_cache = ResponseCache(
+            ExactCache(args.response_cache_size),
+            semantic,
+            # Embeddings use the model, so compute them on the engine thread
+            embed=lambda text: asyncio.wrap_future(scheduler.call(lambda: embed_text(model, tokenizer, text))),
+        )
+
+    app = create_app(
+        scheduler.start(),
+        args.model,
+        admission,
+        response_cache,
+        stream_coalesce_ms=args.stream_coalesce_ms,
+        stream_coalesce_tokens=args.stream_coalesce_tokens,
+        stream_coalesce_min_streams=args.stream_coalesce_min_streams,
+    )
+    try:
+        uvicorn.run(app, host=args.host, port=args.port)
+    finally:
+        if response_cache is not None and response_cache.semantic is not None:
+            response_cache.semantic.flush()  # buffered last-use times
+
+
+if __name__ == "__main__":
+    main()
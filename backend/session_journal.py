@@ -0,0 +1,398 @@
+"""Append-only session journal with tail-only resume.
+
+The chat loops keep the conversation in a `messages` list that is gone on
+exit or crash. A `SessionJournal` appends every message (user, assistant,
+tool result) to `<session>.journal` as a length-prefixed record. A side file,
+`<session>.index`, holds one fixed-size entry per record.
+
+    journal:  header | [len u32, crc32 u32, kind u32, tokens u32, JSON] ...
+    index:    header | [offset u64, tokens u32, kind u32] ...
+
+Resuming memory-maps the index and walks it backwards from the end,
+summing per-message token estimates until the context budget is spent.
+Only those records are then decoded from the memory-mapped journal. Resume
+cost therefore depends on the size of the tail, not the length of the
+session. Leading system messages are pinned and always returned.
+
+`pop()` appends a tombstone rather than rewriting the file, so every write
+is an append. Compaction drops popped messages and tombstones by rewriting
+both files in a background thread, then swapping them in. Records appended
+while it runs are carried over. A crash at any point leaves either the old
+or the new generation; a torn tail or a stale index is repaired on open.
+
+Resumed history can warm the server's KV prefix cache (see
+`warm_prefix_cache`), so the first turn after a resume skips re-prefilling
+the conversation.
+"""
+
+import json
+import mmap
+import os
+import re
+import struct
+import threading
+import zlib
+
+DEFAULT_SESSION_DIR = os.path.join(os.path.expanduser("~"), ".cache", "cupertino_ink", "sessions")
+DEFAULT_CONTEXT_BUDGET = 8192  # tokens of history loaded on resume
+COMPACT_MIN_DEAD = 64  # dead records before automatic compaction is considered
+COMPACT_DEAD_RATIO = 0.25  # ...and the fraction of the journal they must make up
+
+_JOURNAL_MAGIC = b"CIJ1"
+_INDEX_MAGIC = b"CII1"
+_FILE_HEADER = struct.Struct("<4s8s")  # magic, generation
+_RECORD = struct.Struct("<IIII")  # payload length, crc32, kind, tokens
+_ENTRY = struct.Struct("<QII")  # record offset, tokens, kind
+
+# Record kinds
+MESSAGE = 0
+PINNED = 1  # leading system message(s); always loaded
+POP = 2  # tombstone; `tokens` holds how many messages it removes
+
+
+def estimate_tokens(message: dict) -> int:
+    """Rough token count (~4 bytes of JSON per token)."""
+    return max(1, len(json.dumps(message)) // 4)
+
+
+def _session_path(root: str, session_id: str) -> str:
+    if not re.fullmatch(r"[A-Za-z0-9_.-]+", session_id):
+        raise ValueError(f"Invalid session id '{session_id}'; use letters, digits, '.', '_' and '-'.")
+    return os.path.join(root, session_id)
+
+
+def _new_files(base: str, suffix: str = ""):
+    """Create an empty journal/index pair with a fresh generation."""
+    generation = os.urandom(8)
+    journal = open(base + ".journal" + suffix, "wb+")
+    journal.write(_FILE_HEADER.pack(_JOURNAL_MAGIC, generation))
+    index = open(base + ".index" + suffix, "wb+")
+    index.write(_FILE_HEADER.pack(_INDEX_MAGIC, generation))
+    return journal, index
+
+
+def _map(f):
+    f.flush()
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class SessionJournal:
+    def __init__(
+        self,
+        session_id: str,
+        root: str = DEFAULT_SESSION_DIR,
+        token_counter=estimate_tokens,
+        fsync: bool = False,
+        auto_compact: bool = True,
+    ):
+        """Open (or create) the journal for `session_id` under `root`.
+
+        `fsync=True` makes every append durable across power loss, not just
+        process crashes, at the cost of a disk flush per message.
+        """
+        os.makedirs(root, exist_ok=True)
+        self.session_id = session_id
+        self.base = _session_path(root, session_id)
+        self.token_counter = token_counter
+        self.fsync = fsync
+        self.auto_compact = auto_compact
+        self._lock = threading.Lock()
+        self._compactor = None
+        self._open()
+
+    # --- Open / recovery ---
+    def _open(self):
+        if not os.path.exists(self.base + ".journal"):
+            self._journal, self._index = _new_files(self.base)
+            self._sync()
+        else:
+            self._journal = open(self.base + ".journal", "rb+")
+            self._index = open(self.base + ".index", "rb+" if os.path.exists(self.base + ".index") else "wb+")
+            self._recover()
+        self._count = (self._index.seek(0, os.SEEK_END) - _FILE_HEADER.size) // _ENTRY.size
+        self._pinned = 0
+        with _map(self._index) as index:
+            for i in range(self._count):
+                if _ENTRY.unpack_from(index, _FILE_HEADER.size + i * _ENTRY.size)[2] != PINNED:
+                    break
+                self._pinned += 1
+        # Only counts records killed in this process; older ones go at the next compaction
+        self._dead = 0
+
+    def _recover(self):
+        """Bring the index in line with the journal after a crash."""
+        magic, generation = _FILE_HEADER.unpack(self._journal.read(_FILE_HEADER.size))
+        if magic != _JOURNAL_MAGIC:
+            raise ValueError(f"{self.base}.journal is not a session journal")
+        header = self._index.read(_FILE_HEADER.size)
+        index_size = self._index.seek(0, os.SEEK_END)
+        if (
+            len(header) < _FILE_HEADER.size
+            or _FILE_HEADER.unpack(header) != (_INDEX_MAGIC, generation)
+            or (index_size - _FILE_HEADER.size) % _ENTRY.size
+        ):
+            # Missing, torn or from another generation: rebuild from scratch
+            self._index.seek(0)
+            self._index.truncate()
+            self._index.write(_FILE_HEADER.pack(_INDEX_MAGIC, generation))
+            index_size = _FILE_HEADER.size
+
+        journal_size = self._journal.seek(0, os.SEEK_END)
+        # Drop index entries that point past the journal, then find where indexing stopped
+        position = _FILE_HEADER.size
+        with _map(self._index) as index:
+            n = (index_size - _FILE_HEADER.size) // _ENTRY.size
+            while n:
+                offset, _, _ = _ENTRY.unpack_from(index, _FILE_HEADER.size + (n - 1) * _ENTRY.size)
+                self._journal.seek(offset)
+                head = self._journal.read(_RECORD.size)
+                if len(head) == _RECORD.size and offset + _RECORD.size + _RECORD.unpack(head)[0] <= journal_size:
+                    position = offset + _RECORD.size + _RECORD.unpack(head)[0]
+                    break
+                n -= 1
+        self._index.truncate(_FILE_HEADER.size + n * _ENTRY.size)
+
+        # Index any complete records written after the last index entry; cut a torn tail
+        self._journal.seek(position)
+        self._index.seek(0, os.SEEK_END)
+        while position < journal_size:
+            head = self._journal.read(_RECORD.size)
+            if len(head) < _RECORD.size:
+                break
+            length, crc, kind, tokens = _RECORD.unpack(head)
+            payload = self._journal.read(length)
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                break
+            self._index.write(_ENTRY.pack(position, tokens, kind))
+            position += _RECORD.size + length
+        self._journal.truncate(position)
+        self._journal.seek(0, os.SEEK_END)
+        self._sync()
+
+    def _sync(self):
+        self._journal.flush()
+        self._index.flush()
+        if self.fsync:
+            os.fsync(self._journal.fileno())
+            os.fsync(self._index.fileno())
+
+    # --- Writes ---
+    def _write(self, kind: int, payload: bytes, tokens: int):
+        offset = self._journal.seek(0, os.SEEK_END)
+        self._journal.write(_RECORD.pack(len(payload), zlib.crc32(payload), kind, tokens) + payload)
+        # Journal first: a crash between the two writes is repaired by _recover
+        self._journal.flush()
+        self._index.seek(0, os.SEEK_END)
+        self._index.write(_ENTRY.pack(offset, tokens, kind))
+        self._count += 1
+        self._sync()
+
+    def append(self, message: dict):
+        with self._lock:
+            kind = PINNED if self._pinned == self._count and message.get("role") == "system" else MESSAGE
+            self._write(kind, json.dumps(message).encode(), self.token_counter(message))
+            if kind == PINNED:
+                self._pinned += 1
+
+    def extend(self, messages):
+        for message in messages:
+            self.append(message)
+
+    def pop(self, count: int = 1):
+        """Remove the last `count` messages (recorded as a tombstone)."""
+        with self._lock:
+            self._write(POP, b"", count)
+            self._dead += count + 1
+        self._maybe_compact()
+
+    # --- Reads ---
+    def _live_indices(self, index, budget=None, count=None) -> list:
+        """Record numbers of live messages, newest first, within `budget` tokens."""
+        chosen, popped, remaining = [], 0, budget
+        for i in range((self._count if count is None else count) - 1, self._pinned - 1, -1):
+            _, tokens, kind = _ENTRY.unpack_from(index, _FILE_HEADER.size + i * _ENTRY.size)
+            if kind == POP:
+                popped += tokens
+            elif popped:
+                popped -= 1
+            else:
+                if remaining is not None:
+                    if tokens > remaining and chosen:
+                        break
+                    remaining -= tokens
+                chosen.append(i)
+        return chosen
+
+    def load(self, budget_tokens: int = None) -> list:
+        """Pinned messages plus the newest messages that fit in `budget_tokens`.
+
+        `None` loads the whole live history. A tail never starts with a
+        `tool` message whose assistant `tool_calls` message was cut off.
+        """
+        with self._lock:
+            if self._count == 0:
+                return []
+            with _map(self._index) as index, _map(self._journal) as journal:
+                pinned_tokens = 0
+                entries = []
+                for i in range(self._pinned):
+                    offset, tokens, _ = _ENTRY.unpack_from(index, _FILE_HEADER.size + i * _ENTRY.size)
+                    pinned_tokens += tokens
+                    entries.append(offset)
+                budget = None if budget_tokens is None else max(budget_tokens - pinned_tokens, 0)
+                tail = self._live_indices(index, budget)[::-1]
+                entries += [_ENTRY.unpack_from(index, _FILE_HEADER.size + i * _ENTRY.size)[0] for i in tail]
+
+                messages = []
+                for offset in entries:
+                    length = _RECORD.unpack_from(journal, offset)[0]
+                    start = offset + _RECORD.size
+                    messages.append(json.loads(journal[start : start + length]))
+        while len(messages) > self._pinned and messages[self._pinned].get("role") == "tool":
+            del messages[self._pinned]
+        return messages
+
+    # --- Compaction ---
+    def _maybe_compact(self):
+        if (
+            self.auto_compact
+            and self._dead >= COMPACT_MIN_DEAD
+            and self._dead >= self._count * COMPACT_DEAD_RATIO
+            and not (self._compactor and self._compactor.is_alive())
+        ):
+            self.compact_in_background()
+
+    def compact_in_background(self) -> threading.Thread:
+        self._compactor = threading.Thread(target=self.compact, name=f"journal-compact-{self.session_id}", daemon=True)
+        self._compactor.start()
+        return self._compactor
+
+    def compact(self):
+        """Rewrite the journal without popped messages and tombstones."""
+        with self._lock:
+            count = self._count
+            pinned = self._pinned
+        # The files are append-only, so everything up to `count` is stable without the lock
+        new_journal, new_index = _new_files(self.base, ".compact")
+        with _map(self._index) as index, _map(self._journal) as journal:
+            kept = 0
+            for i in [*range(pinned), *self._live_indices(index, count=count)[::-1]]:
+                offset, tokens, kind = _ENTRY.unpack_from(index, _FILE_HEADER.size + i * _ENTRY.size)
+                length = _RECORD.unpack_from(journal, offset)[0]
+                new_index.write(_ENTRY.pack(new_journal.tell(), tokens, kind))
+                new_journal.write(journal[offset : offset + _RECORD.size + length])
+                kept += 1
+
+        with self._lock:
+            # Carry over whatever was appended while we were copying
+            with _map(self._index) as index, _map(self._journal) as journal:
+                for i in range(count, self._count):
+                    offset, tokens, kind = _ENTRY.unpack_from(index, _FILE_HEADER.size + i * _ENTRY.size)
+                    length = _RECORD.unpack_from(journal, offset)[0]
+                    new_index.write(_ENTRY.pack(new_journal.tell(), tokens, kind))
+                    new_journal.write(journal[offset : offset + _RECORD.size + length])
+                    kept += 1
+            for f in (new_journal, new_index):
+                f.flush()
+                os.fsync(f.fileno())
+                f.close()
+            self._journal.close()
+            self._index.close()
+            # Journal first; an index left from the old generation is rebuilt on open
+            os.replace(self.base + ".journal.compact", self.base + ".journal")
+            os.replace(self.base + ".index.compact", self.base + ".index")
+            self._journal = open(self.base + ".journal", "rb+")
+            self._index = open(self.base + ".index", "rb+")
+            self._journal.seek(0, os.SEEK_END)
+            self._count = kept
+            self._dead = 0
+
+    def close(self):
+        if self._compactor is not None:
+            self._compactor.join()
+        with self._lock:
+            self._journal.close()
+            self._index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class JournaledHistory(list):
+    """A `messages` list that writes every change through to a journal.
+
+    Drop-in for the chat loops: `append`, `extend`, `+=`, `pop()` of the
+    last message and `truncate` are journaled. Other in-place edits raise
+    `TypeError` rather than leaving the journal out of sync.
+    """
+
+    def __init__(self, journal: SessionJournal, messages=()):
+        super().__init__(messages)
+        self.journal = journal
+
+    def append(self, message):
+        self.journal.append(message)
+        super().append(message)
+
+    def extend(self, messages):
+        messages = list(messages)
+        self.journal.extend(messages)
+        super().extend(messages)
+
+    def __iadd__(self, messages):
+        self.extend(messages)
+        return self
+
+    def pop(self, index: int = -1):
+        if index not in (-1, len(self) - 1):
+            raise ValueError("JournaledHistory only supports popping the last message")
+        message = super().pop()
+        self.journal.pop()
+        return message
+
+    def truncate(self, length: int):
+        """Drop every message after the first `length` (one tombstone)."""
+        removed = len(self) - length
+        if removed > 0:
+            super().__delitem__(slice(length, None))
+            self.journal.pop(removed)
+
+    def _unsupported(self, *args, **kwargs):
+        raise TypeError("JournaledHistory only supports append, extend, pop() and truncate")
+
+    __delitem__ = __setitem__ = insert = remove = clear = sort = reverse = __imul__ = _unsupported
+
+
+def resume(session_id: str, budget_tokens: int = DEFAULT_CONTEXT_BUDGET, root: str = DEFAULT_SESSION_DIR):
+    """Open `session_id` and return a `JournaledHistory` of its recent tail."""
+    journal = SessionJournal(session_id, root=root)
+    return JournaledHistory(journal, journal.load(budget_tokens))
+
+
+def warm_prefix_cache(base_url: str, messages: list, model: str = None, tools: list = None, timeout: float = 5.0):
+    """Ask the server to prefill `messages` into its KV prefix cache.
+
+    Runs in a daemon thread and ignores failures (e.g. an older server
+    without the endpoint); the next chat request simply prefills as usual.
+    """
+    from urllib import request as urlrequest
+
+    def post():
+        body = json.dumps({"model": model, "messages": messages, "tools": tools}).encode()
+        req = urlrequest.Request(
+            base_url.rstrip("/") + "/prefix_cache/warm",
+            data=body,
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        try:
+            urlrequest.urlopen(req, timeout=timeout).close()
+        except Exception:
+            pass
+
+    thread = threading.Thread(target=post, name="prefix-cache-warm", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,202 @@
+"""Throughput of the streaming response path (`cupertino bench sse`).
+
+Two measurements, each comparing the per-token `json.dumps` path the server
+used to take ("baseline") with `sse.ChunkEncoder` + `sse.coalesce`:
+
+- encode: events/sec for serializing one content delta per token. The
+  encoder's output is checked byte for byte against `json.dumps`.
+- stream: `--streams` concurrent completions fed by a simulated engine that
+  emits one token per stream every `--step-ms`, like the scheduler's batched
+  decode. Events are written to loopback sockets and read back. Reports
+  events and bytes on the wire, process CPU per token (both socket ends),
+  the client's cost of parsing every `data:` line, and how long tokens
+  waited between being generated and being sent.
+
+No model is loaded; the token texts come from `benchmarks/heldout.txt`.
+
+    cupertino bench sse
+    cupertino bench sse --streams 256 --step-ms 5 --output sse.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import socket
+import statistics
+import sys
+import time
+
+from .events import Finished, TokenEvent
+from .sse import DEFAULT_COALESCE_MIN_STREAMS, DEFAULT_COALESCE_MS, DEFAULT_COALESCE_TOKENS, ChunkEncoder, coalesce
+
+CORPUS = os.path.join(os.path.dirname(__file__), "benchmarks", "heldout.txt")
+# Rough stand-in for BPE pieces: a word with its leading space, or one punctuation mark
+TOKEN_PATTERN = re.compile(r" ?\w+| ?[^\w\s]|\s+")
+
+DEFAULT_ENCODE_EVENTS = 200_000
+DEFAULT_STREAMS = 64
+DEFAULT_TOKENS = 200  # per stream
+DEFAULT_STEP_MS = 10.0  # simulated decode step; every stream gets one token per step
+
+
+def load_tokens() -> list:
+    with open(CORPUS) as f:
+        return TOKEN_PATTERN.findall(f.read())
+
+
+def _baseline_event(encoder: ChunkEncoder, text: str) -> str:
+    # What the server did for every token before the pre-serialized envelope
+    return f"data: {json.dumps(encoder.chunk({'content': text}))}\n\n"
+
+
+def bench_encode(tokens: list, count: int) -> dict:
+    encoder = ChunkEncoder("chatcmpl-0123456789abcdef0123456789abcdef", int(time.time()), "mlx-community/QwQ-32B-4bit")
+    texts = [tokens[i % len(tokens)] for i in range(count)]
+    for text in texts[:1000]:
+        if encoder.delta("content", text) != _baseline_event(encoder, text):
+            raise AssertionError(f"encoder output differs from json.dumps for {text!r}")
+
+    results = {}
+    for mode, encode in (("baseline", _baseline_event), ("encoder", lambda e, t: e.delta("content", t))):
+        start = time.perf_counter()
+        for text in texts:
+            encode(encoder, text)
+        elapsed = time.perf_counter() - start
+        results[mode] = {"events_per_sec": round(count / elapsed), "us_per_event": round(elapsed / count * 1e6, 3)}
+    return results
+
+
+async def _engine(queues, tokens: list, per_stream: int, step: float, sent_at: list):
+    """One token to every stream per step, stamped with the time it was produced."""
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    for index in range(per_stream):
+        await asyncio.sleep(max(0.0, start + index * step - loop.time()))
+        sent_at.append(loop.time())
+        text = tokens[index % len(tokens)]
+        for events in queues:
+            events.put_nowait(TokenEvent(index, text))
+    for events in queues:
+        events.put_nowait(Finished("length", 0, per_stream))
+
+
+async def _source(events: asyncio.Queue):
+    while True:
+        event = await events.get()
+        yield event
+        if isinstance(event, Finished):
+            return
+
+
+async def _serve(events, encoder: ChunkEncoder, coalesced: bool, sock, waits: list, sent_at: list):
+    """The server side of one stream: encode each event and write it to the socket."""
+    loop = asyncio.get_running_loop()
+    _, writer = await asyncio.open_connection(sock=sock)
+    first = 0  # index of the first token in the next event
+    async for event in events:
+        if not isinstance(event, TokenEvent):
+            continue
+        data = encoder.delta("content", event.text) if coalesced else _baseline_event(encoder, event.text)
+        writer.write(data.encode())
+        await writer.drain()
+        waits.append(loop.time() - sent_at[first])
+        first = event.token + 1
+    writer.close()
+    await writer.wait_closed()
+
+
+async def _read(sock, wire: list):
+    """The client side: read events off the socket until the server closes it."""
+    reader, writer = await asyncio.open_connection(sock=sock)
+    while line := await reader.readline():
+        if line.startswith(b"data: "):
+            wire.append(line)
+    writer.close()
+
+
+async def _run_stream(tokens, args, coalesced: bool) -> dict:
+    queues = [asyncio.Queue() for _ in range(args.streams)]
+    sent_at, wire, waits = [], [], []
+    tasks = []
+    for i, events in enumerate(queues):
+        source = _source(events)
+        if coalesced:
+            source = coalesce(source, args.coalesce_ms, args.coalesce_tokens, args.coalesce_min_streams)
+        server, client = socket.socketpair()
+        encoder = ChunkEncoder(f"chatcmpl-{i:032x}", int(time.time()), "mlx-community/QwQ-32B-4bit")
+        tasks += [_serve(source, encoder, coalesced, server, waits, sent_at), _read(client, wire)]
+
+    cpu, start = time.process_time(), time.perf_counter()
+    await asyncio.gather(_engine(queues, tokens, args.tokens, args.step_ms / 1000, sent_at), *tasks)
+    elapsed, cpu = time.perf_counter() - start, time.process_time() - cpu
+
+    parse_start = time.perf_counter()
+    for line in wire:
+        json.loads(line[len(b"data: ") :])
+    parse = time.perf_counter() - parse_start
+
+    total_tokens = args.streams * args.tokens
+    wire_bytes = sum(len(line) + 1 for line in wire)  # + the blank line ending each event
+    waits_ms = sorted(w * 1000 for w in waits)
+    return {
+        "events": len(wire),
+        "events_per_sec": round(len(wire) / elapsed),
+        "tokens_per_event": round(total_tokens / len(wire), 2),
+        "wire_bytes": wire_bytes,
+        "bytes_per_token": round(wire_bytes / total_tokens, 1),
+        "cpu_us_per_token": round(cpu / total_tokens * 1e6, 2),
+        "client_parse_us_per_token": round(parse / total_tokens * 1e6, 3),
+        "wait_ms_p50": round(statistics.median(waits_ms), 2),
+        "wait_ms_max": round(waits_ms[-1], 2),
+    }
+
+
+def bench_stream(tokens: list, args) -> dict:
+    return {mode: asyncio.run(_run_stream(tokens, args, mode == "coalesced")) for mode in ("baseline", "coalesced")}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Measure SSE encoding and token coalescing throughput.")
+    parser.add_argument("--encode-events", type=int, default=DEFAULT_ENCODE_EVENTS)
+    parser.add_argument("--streams", type=int, default=DEFAULT_STREAMS, help="Concurrent simulated completions.")
+    parser.add_argument("--tokens", type=int, default=DEFAULT_TOKENS, help="Tokens per completion.")
+    parser.add_argument("--step-ms", type=float, default=DEFAULT_STEP_MS, help="Simulated decode step.")
+    parser.add_argument("--coalesce-ms", type=float, default=DEFAULT_COALESCE_MS)
+    parser.add_argument("--coalesce-tokens", type=int, default=DEFAULT_COALESCE_TOKENS)
+    parser.add_argument("--coalesce-min-streams", type=int, default=DEFAULT_COALESCE_MIN_STREAMS)
+    parser.add_argument("--output", default=None, help="Write the JSON report here.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    tokens = load_tokens()
+    report = {
+        "meta": {
+            "python": sys.version.split()[0],
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "config": {k: v for k, v in vars(args).items() if k != "output"},
+        },
+        "encode": bench_encode(tokens, args.encode_events),
+        "stream": bench_stream(tokens, args),
+    }
+
+    for mode, result in report["encode"].items():
+        print(f"encode  {mode:<10} {result['events_per_sec']:>10,} events/s  {result['us_per_event']:>7.2f} us/event")
+    for mode, result in report["stream"].items():
+        print(
+            f"stream  {mode:<10} {result['events']:>7} events  {result['tokens_per_event']:>5.2f} tok/event  "
+            f"{result['bytes_per_token']:>6.1f} B/tok  cpu {result['cpu_us_per_token']:>6.2f} us/tok  "
+            f"parse {result['client_parse_us_per_token']:>6.2f} us/tok  "
+            f"wait p50 {result['wait_ms_p50']:.1f} ms max {result['wait_ms_max']:.1f} ms"
+        )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+"""Startup-time and import-hygiene check for the `cupertino` CLI.
+
+Each probe runs `python -m cupertino <args>` in a fresh interpreter several
+times and records the median wall time. The probes below use `--help`, so
+nothing but startup is measured. Every probe also runs once under
+`-X importtime`, and fails if it pulled in a module from its forbidden list.
+That catches the usual regression of someone adding `import mlx.core` at
+the top of a client module long before the timing would notice it.
+
+    cupertino bench startup
+    cupertino bench startup --baseline benchmarks/startup_baseline.json --update-baseline
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+HEAVY_MODULES = ("mlx", "mlx_lm", "fastapi", "uvicorn", "starlette", "numpy", "transformers")
+CLIENT_MODULES = HEAVY_MODULES + ("openai", "httpx")
+
+# (name, argv, modules that must not be imported)
+PROBES = [
+    ("help", ["--help"], CLIENT_MODULES),
+    ("chat", ["chat", "--help"], CLIENT_MODULES),
+    ("tools-chat", ["tools-chat", "--help"], CLIENT_MODULES),
+    ("tools-demo", ["tools-demo", "--help"], CLIENT_MODULES),
+    ("batch", ["batch", "--help"], CLIENT_MODULES),
+    ("bench", ["bench", "--help"], CLIENT_MODULES),
+]
+
+DEFAULT_RUNS = 7
+DEFAULT_BUDGET_MS = 150.0  # absolute ceiling on the median for every probe
+DEFAULT_TOLERANCE = 0.25  # relative slowdown allowed against the baseline
+
+
+def _command(argv, importtime=False):
+    return [sys.executable, *(["-X", "importtime"] if importtime else []), "-m", __package__, *argv]
+
+
+def time_probe(argv, runs: int) -> dict:
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(_command(argv), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        samples.append((time.perf_counter() - start) * 1000)
+    return {"median_ms": round(statistics.median(samples), 2), "min_ms": round(min(samples), 2)}
+
+
+def imported_modules(argv) -> dict:
+    """Top-level package -> cumulative import time (us) for one run."""
+    result = subprocess.run(_command(argv, importtime=True), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    totals = {}
+    for line in result.stderr.splitlines():
+        # "import time:      self [us] | cumulative | imported package"
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, package = line.split("|")
+        if not cumulative.strip().isdigit():
+            continue  # header line
+        name = package.strip().split(".")[0]
+        # Nested imports are indented and already included in their parent's cumulative time
+        nested = package[1:].startswith(" ")
+        totals[name] = totals.get(name, 0) + (0 if nested else int(cumulative))
+    return totals
+
+
+def run_probes(args) -> dict:
+    results = {}
+    for name, argv, forbidden in PROBES:
+        timing = time_probe(argv, args.runs)
+        modules = imported_modules(argv)
+        timing["forbidden_imports"] = sorted(m for m in forbidden if m in modules)
+        timing["slowest_imports"] = dict(sorted(modules.items(), key=lambda kv: -kv[1])[:5])
+        results[name] = timing
+        print(f"{name:<12} median {timing['median_ms']:>7.1f} ms  min {timing['min_ms']:>7.1f} ms", file=sys.stderr)
+    return results
+
+
+def check(results: dict, baseline: dict, args) -> list:
+    problems = []
+    for name, result in results.items():
+        if result["forbidden_imports"]:
+            problems.append(f"{name}: imports {', '.join(result['forbidden_imports'])}")
+        if result["median_ms"] > args.budget_ms:
+            problems.append(f"{name}: median {result['median_ms']:.1f} ms exceeds budget {args.budget_ms:.0f} ms")
+        old = (baseline or {}).get("results", {}).get(name)
+        if old and result["median_ms"] > old["median_ms"] * (1 + args.tolerance):
+            problems.append(f"{name}: median {result['median_ms']:.1f} ms vs baseline {old['median_ms']:.1f} ms")
+    return problems
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Measure `cupertino` CLI startup time and import hygiene.")
+    parser.add_argument("--runs", type=int, default=DEFAULT_RUNS, help="Runs per probe; the median is reported.")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--output", default=None, help="Write the JSON report here.")
+    parser.add_argument("--baseline", default=None, help="Baseline JSON report to compare against.")
+    parser.add_argument("--update-baseline", action="store_true", help="Overwrite the baseline with this run.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = {
+        "meta": {"python": sys.version.split()[0], "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z")},
+        "results": run_probes(args),
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline and args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline updated: {args.baseline}", file=sys.stderr)
+        return 0
+
+    baseline = None
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    problems = check(report["results"], baseline, args)
+    for line in problems:
+        print(f"REGRESSION {line}", file=sys.stderr)
+    if problems:
+        return 1
+    print("Startup within budget.", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+"""Customer-support tools used by the chat clients.
+
+Kept free of side effects at import time so tool-sandbox worker processes
+can import (and pre-warm) this module.
+"""
+
+import sys
+from datetime import datetime, timedelta
+
+# --- Tool Definitions (OpenAI format) ---
+SUPPORT_TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "find_order_by_name",
+            "description": "Finds a customer's order ID based on their name. Call this first when a customer asks about their order but doesn't provide an order ID.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "customer_name": {
+                        "type": "string",
+                        "description": "The full name of the customer.",
+                    },
+                },
+                "required": ["customer_name"],
+            },
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "get_delivery_date",
+            "description": "Get the estimated delivery date for a specific order ID. Only call this *after* you have obtained the order ID.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "order_id": {
+                        "type": "string",
+                        "description": "The customer's unique order identifier, potentially obtained using find_order_by_name.",
+                    },
+                },
+                "required": ["order_id"],
+            },
+        }
+    },
+]
+
+# --- Mock Tool Implementations (Replace with your actual logic) ---
+def find_order_by_name(customer_name: str) -> dict:
+    """Simulates finding an order ID based on customer name."""
+    print(f"\n--- Tool Call: find_order_by_name(customer_name='{customer_name}') ---", file=sys.stderr)
+    # Basic validation and simulation
+    if isinstance(customer_name, str) and " " in customer_name.strip() and len(customer_name.strip()) > 3:
+        simulated_id = f"ORD-{customer_name.strip().split()[0][:3].upper()}{len(customer_name.strip()):02d}"
+        print(f"  -> Found order ID: {simulated_id}", file=sys.stderr)
+        return {"order_id": simulated_id}
+    else:
+        print(f"  -> No order found for name: '{customer_name}' (Input type: {type(customer_name)})", file=sys.stderr)
+        return {"order_id": None, "message": f"Could not find an order associated with the name '{customer_name}'. Please verify the name."}
+
+def get_delivery_date(order_id: str) -> dict:
+    """Simulates fetching delivery date based on order ID."""
+    print(f"\n--- Tool Call: get_delivery_date(order_id='{order_id}') ---", file=sys.stderr)
+    if isinstance(order_id, str) and order_id.strip().startswith("ORD-"):
+        estimated_delivery = datetime.now() + timedelta(days=3)
+        result = {
+            "order_id": order_id,
+            "estimated_delivery_date": estimated_delivery.strftime('%Y-%m-%d')
+        }
+        print(f"  -> Estimated Delivery: {result['estimated_delivery_date']}", file=sys.stderr)
+        return result
+    else:
+         print(f"  -> Invalid Order ID format: '{order_id}' (Input type: {type(order_id)})", file=sys.stderr)
+         return {"error": f"Invalid or missing order_id provided: '{order_id}'."}
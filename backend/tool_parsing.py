@@ -0,0 +1,223 @@
+"""Raw-text tool-call formats emitted by the supported model families.
+
+Chat templates differ in how a model writes a tool call into its output:
+
+    Qwen / generic HF   <tool_call>{"name": ..., "arguments": {...}}</tool_call>
+    Llama 3.1           <|python_tag|>{"name": ..., "parameters": {...}}
+    Mistral             [TOOL_CALLS][{"name": ..., "arguments": {...}}, ...]
+
+`parse_tool_calls` turns any of these into OpenAI-style `tool_calls` entries.
+Clients use it as a fallback when a server streams the raw text instead of
+structured `delta.tool_calls`.
+
+`ToolCallDetector` does the same incrementally on the server: it separates
+plain content from tool-call markup as text is generated, and reports when
+the call payload has closed so decoding can stop right there.
+"""
+
+import json
+import re
+import uuid
+
+# format -> (opening marker, pattern capturing the JSON payload)
+TOOL_CALL_FORMATS = {
+    "huggingface": ("<tool_call>", re.compile(r"<tool_call>\s*(\{.*?\})\s*</tool_call>", re.DOTALL)),
+    "llama3": ("<|python_tag|>", re.compile(r"<\|python_tag\|>\s*(\{.*?\})\s*(?:<\|eom_id\|>|<\|eot_id\|>|$)", re.DOTALL)),
+    "mistral": ("[TOOL_CALLS]", re.compile(r"\[TOOL_CALLS\]\s*(\[.*?\])\s*(?:</s>|$)", re.DOTALL)),
+}
+
+
+def detect_tool_call_format(tokenizer):
+    """The `TOOL_CALL_FORMATS` key the model's chat template uses, or None."""
+    template = getattr(tokenizer, "chat_template", None) or ""
+    if isinstance(template, dict):  # some tokenizers ship named templates
+        template = " ".join(str(t) for t in template.values())
+    vocab = tokenizer.get_vocab() if hasattr(tokenizer, "get_vocab") else {}
+    for fmt, (marker, _) in TOOL_CALL_FORMATS.items():
+        if marker in template or marker in vocab:
+            return fmt
+    return None
+
+
+def new_tool_call_id() -> str:
+    return f"call_{uuid.uuid4().hex[:12]}"
+
+
+def _to_tool_call(call: dict):
+    if not isinstance(call, dict) or not call.get("name"):
+        return None
+    arguments = call.get("arguments", call.get("parameters", {}))
+    return {
+        "id": new_tool_call_id(),
+        "type": "function",
+        "function": {
+            "name": call["name"],
+            # Serialized like OpenAI's own tool_calls; consumers json.loads it
+            "arguments": arguments if isinstance(arguments, str) else json.dumps(arguments),
+        },
+    }
+
+
+def parse_tool_calls(text: str) -> list:
+    """All tool calls found in `text`, in order of appearance.
+
+    Malformed JSON or entries without a `name` are skipped.
+    """
+    found = []
+    for fmt, (_, pattern) in TOOL_CALL_FORMATS.items():
+        for match in pattern.finditer(text):
+            try:
+                data = json.loads(match.group(1))
+            except json.JSONDecodeError:
+                continue
+            for call in data if isinstance(data, list) else [data]:
+                tool_call = _to_tool_call(call)
+                if tool_call is not None:
+                    found.append((match.start(), tool_call))
+    return [tool_call for _, tool_call in sorted(found, key=lambda item: item[0])]
+
+
+_HF_TAG = re.compile(r"<(/?)tool_call>")
+_CLOSE_TAG = "</tool_call>"
+_PARALLEL_GRACE_SEGMENTS = 4  # segments to wait after </tool_call> for another <tool_call>
+
+
+class _JsonEnd:
+    """Finds where a JSON value closes in text that only grows.
+
+    Each `scan` resumes where the previous one stopped, so feeding a long
+    payload token by token costs linear time overall.
+    """
+
+    def __init__(self, start: int):
+        self.pos = start
+        self.depth, self.in_string, self.escaped = 0, False, False
+        self.invalid = False  # not JSON; never completes
+
+    def scan(self, text: str):
+        """Index just past the JSON value starting at or after `start`, or None if it hasn't closed."""
+        if self.invalid:
+            return None
+        for i in range(self.pos, len(text)):
+            ch = text[i]
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif ch == "\\":
+                    self.escaped = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                self.in_string = True
+            elif ch in "{[":
+                self.depth += 1
+            elif ch in "}]":
+                self.depth -= 1
+                if self.depth == 0:
+                    self.pos = i + 1
+                    return i + 1
+            elif self.depth == 0 and not ch.isspace():
+                self.invalid = True
+                return None
+        self.pos = len(text)
+        return None
+
+
+class ToolCallDetector:
+    """Incremental tool-call recognizer for one generation.
+
+    `feed` takes each new text segment and returns the part that is plain
+    content and safe to stream now. A trailing fragment that could be the
+    start of the opening marker is held back until it's resolved. Once
+    `complete` is true, the tool call payload has closed and nothing the
+    model generates afterwards is needed.
+
+    With `parallel_tool_calls`, a closed `<tool_call>` block isn't the end:
+    the detector waits to see whether another block follows. Mistral emits
+    every call in one JSON array, and Llama's `<|python_tag|>` carries a
+    single call, so for those the first closed payload always ends it.
+    The wait is bounded: if no new block has started within a few
+    segments of the last `</tool_call>`, the calls are complete.
+
+    Only text added since the previous `feed` is scanned, so a long
+    argument payload costs linear time, not quadratic.
+    """
+
+    def __init__(self, fmt: str, parallel_tool_calls: bool = True):
+        self.fmt = fmt
+        self.marker = TOOL_CALL_FORMATS[fmt][0]
+        self.parallel_tool_calls = parallel_tool_calls
+        self.text = ""
+        self.call_start = None  # index of the first marker in `text`
+        self.complete = False
+        self._emitted = 0  # `text[:_emitted]` has been returned as content
+        self._json = None  # payload scanner (Llama, Mistral)
+        self._scanned = 0  # `text[:_scanned]` has been searched for <tool_call> tags
+        self._open = 0  # <tool_call> blocks not yet closed
+        self._closed_at = None  # end of the last </tool_call> in `text`
+        self._since_close = 0  # segments fed since then
+
+    def feed(self, segment: str) -> str:
+        self.text += segment
+        if self.call_start is None:
+            index = self.text.find(self.marker, max(self._emitted - len(self.marker), 0))
+            if index < 0:
+                # Hold back a suffix that may still grow into the marker
+                hold = next(
+                    (n for n in range(min(len(self.marker) - 1, len(self.text)), 0, -1) if self.marker.startswith(self.text[-n:])),
+                    0,
+                )
+                return self._emit(len(self.text) - hold)
+            self.call_start = index
+            content = self._emit(index)
+        else:
+            content = ""
+        if not self.complete:
+            self.complete = self._payload_closed()
+        return content
+
+    def check(self, segment: str):
+        """`feed` for the scheduler's `stop_when` hook: the finish reason once complete."""
+        self.feed(segment)
+        return "tool_calls" if self.complete else None
+
+    def flush(self) -> str:
+        """Held-back content at the end of generation (no tool call followed)."""
+        return self._emit(len(self.text)) if self.call_start is None else ""
+
+    def tool_calls(self) -> list:
+        return parse_tool_calls(self.markup) if self.call_start is not None else []
+
+    @property
+    def markup(self) -> str:
+        return self.text[self.call_start :] if self.call_start is not None else ""
+
+    def _emit(self, end: int) -> str:
+        content = self.text[self._emitted : end] if end > self._emitted else ""
+        self._emitted = max(self._emitted, end)
+        return content
+
+    def _payload_closed(self) -> bool:
+        if self.fmt != "huggingface":
+            if self._json is None:
+                self._json = _JsonEnd(self.call_start + len(self.marker))
+            return self._json.scan(self.text) is not None
+        self._since_close += 1
+        for match in _HF_TAG.finditer(self.text, max(self._scanned, self.call_start)):
+            if match.group(1):
+                self._open -= 1
+                self._closed_at, self._since_close = match.end(), 0
+            else:
+                self._open += 1
+            self._scanned = match.end()
+        # A tag split across segments is searched again once the rest arrives
+        self._scanned = max(self._scanned, len(self.text) - len(_CLOSE_TAG) + 1)
+        if self._open > 0 or self._closed_at is None:
+            return False
+        if not self.parallel_tool_calls:
+            return True
+        # Another call may follow; anything other than its marker means we're done
+        rest = self.text[self._closed_at :].lstrip()
+        if rest and not self.marker.startswith(rest):
+            return True
+        return self._since_close >= _PARALLEL_GRACE_SEGMENTS
@@ -0,0 +1,169 @@
+"""Out-of-band storage for large tool results.
+
+Tool responses are appended to `messages` as `role: tool` content and
+re-sent on every later turn, so a 20 KB order history is prefilled again
+and again. `ToolResultStore` keeps each full payload in a local
+content-addressed blob store (sha256 of its canonical JSON). History
+carries only a compact projection plus a `result_ref`. The built-in
+`expand_result` tool lets the model fetch more detail (optionally a sub-path
+of the result) only when it actually needs it.
+
+Small results (under `inline_limit` bytes) are still inlined unchanged. The
+summary of a large one is tightened until it fits in `summary_limit` bytes,
+so a digest is never larger than the result it replaces.
+
+`result_ref` comes from the model, and text inside tool output can steer the
+model, so `expand_result` only accepts a bare sha256 hex digest and can't be
+pointed at other files.
+"""
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+
+DEFAULT_STORE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "cupertino_ink", "tool_results")
+DEFAULT_INLINE_LIMIT = 1024  # bytes of JSON kept inline in history
+DEFAULT_EXPAND_LIMIT = 4096  # bytes returned by expand_result before projecting again
+DEFAULT_SUMMARY_LIMIT = 2048  # bytes of projected summary kept in history
+_REF = re.compile(r"[0-9a-f]{64}")
+# Progressively tighter project() settings: (max_items, max_keys, max_string, depth)
+_SUMMARY_LEVELS = [(3, 20, 200, 3), (2, 10, 100, 2), (1, 5, 40, 1), (0, 0, 0, 0)]
+
+# --- Tool Definition (OpenAI format) ---
+EXPAND_RESULT_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "expand_result",
+        "description": "Fetch more detail from a large tool result that was summarized in the conversation. "
+        "Only call this when the summary does not contain what you need.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "result_ref": {
+                    "type": "string",
+                    "description": "The result_ref value from the summarized tool result.",
+                },
+                "path": {
+                    "type": "string",
+                    "description": "Optional dotted path into the result, e.g. 'orders.2.tracking'. Omit for the top level.",
+                },
+            },
+            "required": ["result_ref"],
+        },
+    },
+}
+
+
+def _canonical(payload) -> bytes:
+    return json.dumps(payload, sort_keys=True, separators=(",", ":")).encode()
+
+
+def project(value, max_items: int = 3, max_string: int = 200, depth: int = 3, max_keys: int = 20):
+    """Compact, shape-preserving preview of `value`.
+
+    Long lists keep their first `max_items` entries plus a count of the rest,
+    objects their first `max_keys` keys likewise, long strings are cut, and
+    nesting below `depth` is replaced by a one-line description.
+    """
+    if isinstance(value, str):
+        return value if len(value) <= max_string else value[:max_string] + f"... ({len(value)} chars)"
+    if isinstance(value, dict):
+        if depth <= 0:
+            keys = ", ".join(str(k)[:40] for k in list(value)[:5])
+            return f"<object with {len(value)} keys: {keys}>"
+        preview = {k: project(v, max_items, max_string, depth - 1, max_keys) for k, v in list(value.items())[:max_keys]}
+        if len(value) > max_keys:
+            preview["..."] = f"{len(value) - max_keys} more keys"
+        return preview
+    if isinstance(value, list):
+        if depth <= 0:
+            return f"<list of {len(value)} items>"
+        preview = [project(v, max_items, max_string, depth - 1, max_keys) for v in value[:max_items]]
+        if len(value) > max_items:
+            preview.append(f"... {len(value) - max_items} more items")
+        return preview
+    return value
+
+
+class ToolResultStore:
+    def __init__(
+        self,
+        root: str = DEFAULT_STORE_DIR,
+        inline_limit: int = DEFAULT_INLINE_LIMIT,
+        expand_limit: int = DEFAULT_EXPAND_LIMIT,
+        summary_limit: int = DEFAULT_SUMMARY_LIMIT,
+    ):
+        self.root = root
+        self.inline_limit = inline_limit
+        self.expand_limit = expand_limit
+        self.summary_limit = summary_limit
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, ref: str) -> str:
+        if not _REF.fullmatch(ref):
+            raise ValueError(f"Invalid result_ref: {ref!r}")
+        return os.path.join(self.root, ref[:2], ref[2:] + ".json")
+
+    def put(self, payload) -> str:
+        """Store `payload` and return its content address."""
+        data = _canonical(payload)
+        ref = hashlib.sha256(data).hexdigest()
+        path = self._path(ref)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write-then-rename so a crash never leaves a truncated blob
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        return ref
+
+    def get(self, ref: str):
+        with open(self._path(ref), "rb") as f:
+            return json.loads(f.read())
+
+    def to_message_content(self, payload) -> str:
+        """`role: tool` content for `payload`: inline if small, else a digest."""
+        data = _canonical(payload)
+        if len(data) <= self.inline_limit:
+            return json.dumps(payload)
+        ref = self.put(payload)
+        limit = min(self.summary_limit, len(data))
+        for max_items, max_keys, max_string, depth in _SUMMARY_LEVELS:
+            summary = project(payload, max_items, max_string, depth, max_keys)
+            if len(_canonical(summary)) <= limit:
+                break
+        return json.dumps(
+            {
+                "result_ref": ref,
+                "size_bytes": len(data),
+                "summary": summary,
+                "note": "Large result summarized. Call expand_result with this result_ref (and an optional path) for detail.",
+            }
+        )
+
+    def expand_result(self, result_ref: str, path: str = None) -> dict:
+        """Implementation of the `expand_result` tool."""
+        if not isinstance(result_ref, str) or not _REF.fullmatch(result_ref):
+            return {"error": f"Invalid result_ref: '{result_ref}'."}
+        try:
+            value = self.get(result_ref)
+        except FileNotFoundError:
+            return {"error": f"No stored result for result_ref '{result_ref}'."}
+        for part in (path or "").split("."):
+            if not part:
+                continue
+            try:
+                value = value[int(part)] if isinstance(value, list) else value[part]
+            except (KeyError, IndexError, ValueError, TypeError):
+                return {"error": f"Path '{path}' not found in result '{result_ref}' (failed at '{part}')."}
+        if len(_canonical(value)) <= self.expand_limit:
+            return {"result_ref": result_ref, "path": path or "", "value": value}
+        return {
+            "result_ref": result_ref,
+            "path": path or "",
+            "value": project(value, max_items=10, max_string=500, depth=4),
+            "note": "Still large; call expand_result again with a narrower path.",
+        }
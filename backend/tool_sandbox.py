@@ -0,0 +1,289 @@
+"""Warm process-pool execution backend for CPU-heavy or untrusted tools.
+
+Tools registered here run in a pool of pre-started worker processes instead
+of inline in the chat loop. A CPU-heavy tool therefore no longer stalls
+stream handling, several calls run in parallel across cores, and a tool
+that crashes takes down only its worker, which is replaced automatically.
+
+* Workers come from a forkserver that has already imported the tool
+  modules, so both the initial pool and replacements start warm.
+* Arguments and results travel as JSON. Payloads larger than
+  `shm_threshold` bytes go through `multiprocessing.shared_memory` instead
+  of the pipe. JSON rather than pickle means a misbehaving worker can't
+  execute code in the parent.
+* A worker found dead while idle (killed, OOM-reaped) is replaced before
+  the next call is sent to it, so that call still runs.
+* Each call runs under RLIMIT_CPU and RLIMIT_AS limits set in the worker,
+  with a wall-clock backstop in the parent that kills a stuck worker.
+
+    sandbox = ToolSandbox({"get_delivery_date": "support_tools:get_delivery_date"})
+    available_functions["get_delivery_date"] = sandbox.function("get_delivery_date")
+"""
+
+import asyncio
+import importlib
+import json
+import math
+import multiprocessing
+import os
+import queue
+import resource
+import signal
+import threading
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+
+DEFAULT_CPU_TIME_LIMIT = 10.0  # seconds of CPU per call
+DEFAULT_MEMORY_LIMIT_MB = 1024  # address space per worker during a call
+DEFAULT_SHM_THRESHOLD = 64 * 1024  # bytes; larger payloads use shared memory
+_WALL_CLOCK_GRACE = 5.0  # seconds past the CPU limit before the parent kills a worker
+
+
+class ToolSandboxError(Exception):
+    """Base class for sandbox failures surfaced to the caller."""
+
+
+class ToolExecutionError(ToolSandboxError):
+    """The tool raised inside its worker."""
+
+
+class ToolTimeout(ToolSandboxError):
+    """The tool exceeded its CPU-time limit."""
+
+
+class ToolWorkerCrashed(ToolSandboxError):
+    """The worker process died mid-call; it has been replaced."""
+
+
+# --- Payload transport (used on both sides) ---
+def _pack(payload, threshold: int) -> dict:
+    data = json.dumps(payload).encode()
+    if len(data) <= threshold:
+        return {"inline": data.decode()}
+    shm = shared_memory.SharedMemory(create=True, size=len(data))
+    shm.buf[: len(data)] = data
+    shm.close()
+    return {"shm": shm.name, "size": len(data)}
+
+
+def _unpack(message: dict, unlink: bool = True):
+    if "inline" in message:
+        return json.loads(message["inline"])
+    shm = shared_memory.SharedMemory(name=message["shm"])
+    try:
+        return json.loads(bytes(shm.buf[: message["size"]]))
+    finally:
+        shm.close()
+        if unlink:
+            shm.unlink()
+
+
+def _resolve(spec: str):
+    module_name, _, attr = spec.partition(":")
+    return getattr(importlib.import_module(module_name), attr)
+
+
+# --- Worker process ---
+class _CpuLimitExceeded(BaseException):
+    # BaseException so a tool's broad `except Exception` can't swallow it
+    pass
+
+
+def _on_sigxcpu(signum, frame):
+    raise _CpuLimitExceeded()
+
+
+def _worker_main(conn, tool_specs: dict, shm_threshold: int):
+    tools = {name: _resolve(spec) for name, spec in tool_specs.items()}
+    signal.signal(signal.SIGXCPU, _on_sigxcpu)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C is the chat loop's to handle
+    while True:
+        try:
+            request = json.loads(conn.recv_bytes())
+        except (EOFError, OSError):
+            return
+        reply = {"id": request["id"]}
+        try:
+            # Soft limits only: hard limits can't be raised again by an unprivileged process
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            cpu_used = usage.ru_utime + usage.ru_stime
+            resource.setrlimit(
+                resource.RLIMIT_CPU, (math.ceil(cpu_used + request["cpu_time"]), resource.RLIM_INFINITY)
+            )
+            resource.setrlimit(resource.RLIMIT_AS, (request["memory_bytes"], resource.RLIM_INFINITY))
+            try:
+                result = tools[request["name"]](**_unpack(request["args"], unlink=False))
+            finally:
+                resource.setrlimit(resource.RLIMIT_CPU, (resource.RLIM_INFINITY, resource.RLIM_INFINITY))
+                resource.setrlimit(resource.RLIMIT_AS, (resource.RLIM_INFINITY, resource.RLIM_INFINITY))
+            reply.update(ok=True, result=_pack(result, shm_threshold))
+        except _CpuLimitExceeded:
+            reply.update(ok=False, error_type="timeout", error=f"CPU time limit of {request['cpu_time']}s exceeded")
+        except MemoryError:
+            reply.update(ok=False, error_type="MemoryError", error=f"Memory limit of {request['memory_bytes'] >> 20} MB exceeded")
+        except Exception as e:
+            reply.update(ok=False, error_type=type(e).__name__, error=str(e))
+        conn.send_bytes(json.dumps(reply).encode())
+
+
+# --- Parent side ---
+class _Worker:
+    """One worker process plus the parent thread that feeds it calls."""
+
+    def __init__(self, sandbox):
+        self.sandbox = sandbox
+        self.process = None
+        self.conn = None
+        self._spawn()
+
+    def _spawn(self):
+        parent_conn, child_conn = self.sandbox._context.Pipe()
+        self.process = self.sandbox._context.Process(
+            target=_worker_main,
+            args=(child_conn, self.sandbox.tool_specs, self.sandbox.shm_threshold),
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+        self.conn = parent_conn
+
+    def _recycle(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+        self.conn.close()
+        self._spawn()
+
+    def serve(self):
+        while True:
+            task = self.sandbox._tasks.get()
+            if task is None:
+                return
+            call_id, name, args, cpu_time, memory_bytes, future = task
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(self._call(call_id, name, args, cpu_time, memory_bytes))
+            except Exception as e:
+                future.set_exception(e)
+
+    def _call(self, call_id, name, args, cpu_time, memory_bytes):
+        if not self.process.is_alive():
+            self._recycle()  # died while idle; nothing was running on it
+        packed = _pack(args, self.sandbox.shm_threshold)
+        try:
+            request = json.dumps(
+                {"id": call_id, "name": name, "args": packed, "cpu_time": cpu_time, "memory_bytes": memory_bytes}
+            ).encode()
+            try:
+                self.conn.send_bytes(request)
+            except OSError:
+                # Died after the check: the call never reached it, so retry once on a fresh worker
+                self._recycle()
+                self.conn.send_bytes(request)
+            if not self.conn.poll(cpu_time + _WALL_CLOCK_GRACE):
+                self._recycle()
+                raise ToolTimeout(f"Tool '{name}' did not finish within {cpu_time}s and its worker was restarted")
+            reply = json.loads(self.conn.recv_bytes())
+        except (EOFError, OSError):
+            self.process.join(timeout=1)
+            exitcode = self.process.exitcode
+            self._recycle()
+            raise ToolWorkerCrashed(f"Worker running '{name}' died (exit code {exitcode}); it has been replaced")
+        finally:
+            if "shm" in packed:
+                _discard_shm(packed["shm"])
+
+        if reply.get("ok"):
+            return _unpack(reply["result"])
+        if reply.get("error_type") == "timeout":
+            raise ToolTimeout(f"Tool '{name}': {reply['error']}")
+        raise ToolExecutionError(f"Tool '{name}' raised {reply.get('error_type')}: {reply.get('error')}")
+
+    def close(self):
+        self.conn.close()
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.kill()
+
+
+def _discard_shm(name: str):
+    try:
+        shm = shared_memory.SharedMemory(name=name)
+        shm.close()
+        shm.unlink()
+    except FileNotFoundError:
+        pass
+
+
+class ToolSandbox:
+    def __init__(
+        self,
+        tool_specs: dict,
+        workers: int = None,
+        cpu_time_limit: float = DEFAULT_CPU_TIME_LIMIT,
+        memory_limit_mb: int = DEFAULT_MEMORY_LIMIT_MB,
+        shm_threshold: int = DEFAULT_SHM_THRESHOLD,
+    ):
+        """`tool_specs` maps tool names to "module:function" import paths."""
+        self.tool_specs = dict(tool_specs)
+        self.cpu_time_limit = cpu_time_limit
+        self.memory_limit_mb = memory_limit_mb
+        self.shm_threshold = shm_threshold
+        self._context = multiprocessing.get_context("forkserver")
+        # Imported once in the forkserver, inherited by every worker it forks
+        modules = sorted({spec.partition(":")[0] for spec in self.tool_specs.values()})
+        self._context.set_forkserver_preload(modules)
+        self._tasks = queue.Queue()
+        self._call_ids = iter(range(1 << 62))
+        self._workers = [_Worker(self) for _ in range(workers or os.cpu_count() or 1)]
+        self._threads = [
+            threading.Thread(target=worker.serve, name=f"tool-sandbox-{i}", daemon=True)
+            for i, worker in enumerate(self._workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, name: str, arguments: dict, cpu_time: float = None, memory_limit_mb: int = None) -> Future:
+        """Queue a call; the returned future resolves to the tool's result."""
+        if name not in self.tool_specs:
+            raise KeyError(f"Tool '{name}' is not registered with the sandbox")
+        future = Future()
+        memory_bytes = (memory_limit_mb or self.memory_limit_mb) * 1024 * 1024
+        self._tasks.put((next(self._call_ids), name, arguments, cpu_time or self.cpu_time_limit, memory_bytes, future))
+        return future
+
+    def call(self, name: str, **arguments):
+        return self.submit(name, arguments).result()
+
+    def function(self, name: str):
+        """A drop-in replacement for the tool in `available_functions`."""
+
+        def sandboxed(**arguments):
+            return self.call(name, **arguments)
+
+        sandboxed.__name__ = name
+        return sandboxed
+
+    def afunction(self, name: str):
+        """Coroutine version of `function`, for the asyncio agent loop."""
+
+        async def sandboxed(**arguments):
+            return await asyncio.wrap_future(self.submit(name, arguments))
+
+        sandboxed.__name__ = name
+        return sandboxed
+
+    def close(self):
+        for _ in self._threads:
+            self._tasks.put(None)
+        for thread in self._threads:
+            thread.join()
+        for worker in self._workers:
+            worker.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,14 +1,7 @@
+# Streaming `delta.tool_calls` demo: asks the model for a recipe via a tool call.
+# openai is imported in main() so importing this file (e.g. pytest collection) stays cheap.
 import json
 
-from openai import OpenAI
-
-# Configure client to use local server
-client = OpenAI(
-    base_url="http://localhost:11434/v1",  # Point to ollama server
-    # base_url="http://localhost:10240/v1",  # Point to mlx omni server
-    api_key="not-needed",  # API key is not required for local server
-)
-
 # Define functions
 tools = [
     {
@@ -41,58 +34,73 @@ tools = [
     }
 ]
 
-response_stream = client.chat.completions.create(
-    model="mlx-community/Qwen2.5-7B-Instruct-1M-4bit",
-    messages=[
-        {
-            "role": "system",
-            "content": (
-                "You are an expert cook who can help turn any user input into a delicious recipe."
-                "As soon as the user tells you what they want, use the generate_recipe tool to create a detailed recipe for them."
-            ),
-        },
-        {
-            "role": "user",
-            "content": "I want to make pancakes for 4.",
-        },
-    ],
-    tools=tools,
-    stream=True,
-)
 
-function_arguments = ""
-function_name = ""
-is_collecting_function_args = False
+def main():
+    from openai import OpenAI
+
+    # Configure client to use local server
+    client = OpenAI(
+        base_url="http://localhost:11434/v1",  # Point to ollama server
+        # base_url="http://localhost:10240/v1",  # Point to mlx omni server
+        api_key="not-needed",  # API key is not required for local server
+    )
+
+    response_stream = client.chat.completions.create(
+        model="mlx-community/Qwen2.5-7B-Instruct-1M-4bit",
+        messages=[
+            {
+                "role": "system",
+                "content": (
+                    "You are an expert cook who can help turn any user input into a delicious recipe."
+                    "As soon as the user tells you what they want, use the generate_recipe tool to create a detailed recipe for them."
+                ),
+            },
+            {
+                "role": "user",
+                "content": "I want to make pancakes for 4.",
+            },
+        ],
+        tools=tools,
+        stream=True,
+    )
+
+    function_arguments = ""
+    function_name = ""
+    is_collecting_function_args = False
+
+    for part in response_stream:
+        delta = part.choices[0].delta
+        finish_reason = part.choices[0].finish_reason
+
+        # Process assistant content
+        if "content" in delta:
+            print("Assistant:", delta.content)
 
-for part in response_stream:
-    delta = part.choices[0].delta
-    finish_reason = part.choices[0].finish_reason
+        if delta.tool_calls:
+            is_collecting_function_args = True
+            tool_call = delta.tool_calls[0]
 
-    # Process assistant content
-    if "content" in delta:
-        print("Assistant:", delta.content)
+            if tool_call.function.name:
+                function_name = tool_call.function.name
+                print(f"Function name: '{function_name}'")
 
-    if delta.tool_calls:
-        is_collecting_function_args = True
-        tool_call = delta.tool_calls[0]
+            # Process function arguments delta
+            if tool_call.function.arguments:
+                function_arguments += tool_call.function.arguments
+                print(f"Arguments: {function_arguments}")
 
-        if tool_call.function.name:
-            function_name = tool_call.function.name
-            print(f"Function name: '{function_name}'")
+        # Process tool call with complete arguments
+        if finish_reason == "tool_calls" and is_collecting_function_args:
+            print(f"Function call '{function_name}' is complete.")
+            args = json.loads(function_arguments)
+            print("Complete function arguments:")
+            print(json.dumps(args, indent=2))
 
-        # Process function arguments delta
-        if tool_call.function.arguments:
-            function_arguments += tool_call.function.arguments
-            print(f"Arguments: {function_arguments}")
+            # Reset for the next potential function call
+            function_arguments = ""
+            function_name = ""
+            is_collecting_function_args = False
 
-    # Process tool call with complete arguments
-    if finish_reason == "tool_calls" and is_collecting_function_args:
-        print(f"Function call '{function_name}' is complete.")
-        args = json.loads(function_arguments)
-        print("Complete function arguments:")
-        print(json.dumps(args, indent=2))
 
-        # Reset for the next potential function call
-        function_arguments = ""
-        function_name = ""
-        is_collecting_function_args = False
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+"""Tools for tests/test_tool_sandbox.py; imported by the sandbox's workers."""
+
+import os
+import time
+
+
+def echo(**arguments):
+    return arguments
+
+
+def fail(message: str):
+    raise ValueError(message)
+
+
+def crash():
+    os._exit(3)
+
+
+def spin():
+    while True:
+        pass
+
+
+def sleep(seconds: float):
+    time.sleep(seconds)
+    return "woke"
+
+
+def pid():
+    return os.getpid()
@@ -0,0 +1,125 @@
+import asyncio
+
+import pytest
+
+from cupertino import admission
+from cupertino.admission import AdmissionController, AdmissionRejected, MemoryEstimator
+
+
+@pytest.fixture
+def memory(monkeypatch):
+    """Live MLX memory as seen by the controller; tests set `memory["active"]`."""
+    state = {"active": 0}
+    monkeypatch.setattr(admission.mlx_memory, "active_memory", lambda: state["active"])
+    return state
+
+
+def controller(**kwargs) -> AdmissionController:
+    # One byte per token, so a request's estimate is prompt_tokens + max_tokens
+    kwargs.setdefault("memory_limit", 1000)
+    kwargs.setdefault("high_watermark", 1.0)
+    kwargs.setdefault("reject_watermark", 2.0)
+    return AdmissionController(MemoryEstimator(1, 0, 1), **kwargs)
+
+
+def test_admits_until_full_then_queues_in_order(memory):
+    async def run():
+        gate = controller()
+        first = await gate.acquire(600, 0)
+        order = []
+
+        async def wait(name, tokens):
+            reservation = await gate.acquire(tokens, 0)
+            order.append(name)
+            return reservation
+
+        large = asyncio.create_task(wait("large", 500))
+        await asyncio.sleep(0)
+        small = asyncio.create_task(wait("small", 100))  # would fit now, but queues behind the head
+        await asyncio.sleep(0)
+        assert gate.snapshot()["queue_depth"] == 2 and order == []
+
+        first.release()
+        first.release()  # idempotent
+        (await large).release()
+        (await small).release()
+        assert order == ["large", "small"]
+        assert gate.reserved_bytes == 0 and gate.in_flight == 0
+        assert gate.stats.queued == 2 and gate.stats.admitted == 3
+
+    asyncio.run(run())
+
+
+def test_oversized_request_is_rejected_with_413(memory):
+    async def run():
+        with pytest.raises(AdmissionRejected) as e:
+            await controller().acquire(900, 200)
+        assert e.value.status_code == 413
+
+    asyncio.run(run())
+
+
+def test_full_queue_and_reject_watermark_fail_fast(memory):
+    async def run():
+        gate = controller(max_queue_depth=1)
+        held = await gate.acquire(1000, 0)
+        waiter = asyncio.create_task(gate.acquire(10, 0))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as e:
+            await gate.acquire(10, 0)
+        assert e.value.status_code == 429 and "queue is full" in e.value.message
+        held.release()
+        (await waiter).release()
+
+        memory["active"] = 2000
+        with pytest.raises(AdmissionRejected, match="reject watermark"):
+            await gate.acquire(10, 0)
+
+    asyncio.run(run())
+
+
+def test_queue_wait_times_out(memory):
+    async def run():
+        gate = controller(max_queue_wait=0.05)
+        held = await gate.acquire(1000, 0)
+        with pytest.raises(AdmissionRejected, match="Timed out"):
+            await gate.acquire(10, 0)
+        assert gate.snapshot()["queue_depth"] == 0
+        held.release()
+
+    asyncio.run(run())
+
+
+def test_cancelled_waiter_leaves_the_queue(memory):
+    async def run():
+        gate = controller()
+        held = await gate.acquire(1000, 0)
+        waiter = asyncio.create_task(gate.acquire(10, 0))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert gate.snapshot()["queue_depth"] == 0
+        held.release()
+        assert gate.reserved_bytes == 0
+
+    asyncio.run(run())
+
+
+def test_reclaim_makes_room_before_queueing(memory):
+    freed = []
+
+    async def reclaim(nbytes):
+        freed.append(nbytes)
+        memory["active"] -= nbytes
+        return nbytes
+
+    async def run():
+        gate = controller(reclaim=reclaim)
+        memory["active"] = 900  # evictable cache, not reservations
+        reservation = await gate.acquire(200, 0)
+        assert freed == [100]  # only what the request needed
+        assert gate.snapshot()["queued"] == 0 and gate.stats.reclaimed_bytes == 100
+        reservation.release()
+
+    asyncio.run(run())
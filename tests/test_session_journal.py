@@ -0,0 +1,191 @@
+import os
+import struct
+import threading
+
+import pytest
+
+from cupertino import session_journal
+from cupertino.session_journal import JournaledHistory, SessionJournal, resume
+
+SYSTEM = {"role": "system", "content": "You are a support assistant."}
+
+
+def message(i: int) -> dict:
+    return {"role": "user" if i % 2 == 0 else "assistant", "content": f"message {i}"}
+
+
+def journal_with(root, count: int, session="s") -> SessionJournal:
+    journal = SessionJournal(session, root=str(root))
+    journal.append(SYSTEM)
+    journal.extend(message(i) for i in range(count))
+    return journal
+
+
+def test_reopen_returns_everything(tmp_path):
+    journal_with(tmp_path, 5).close()
+    with SessionJournal("s", root=str(tmp_path)) as journal:
+        assert journal.load() == [SYSTEM] + [message(i) for i in range(5)]
+
+
+@pytest.mark.parametrize(
+    "tail",
+    [
+        b"\x07\x00",  # torn record header
+        struct.pack("<IIII", 100, 0, 0, 1) + b'{"role": "us',  # header, then a torn payload
+        struct.pack("<IIII", 2, 12345, 0, 1) + b"{}",  # complete record with a bad checksum
+    ],
+)
+def test_recover_cuts_torn_tail(tmp_path, tail):
+    journal_with(tmp_path, 3).close()
+    path = os.path.join(tmp_path, "s.journal")
+    size = os.path.getsize(path)
+    with open(path, "ab") as f:
+        f.write(tail)
+
+    with SessionJournal("s", root=str(tmp_path)) as journal:
+        assert os.path.getsize(path) == size
+        assert journal.load() == [SYSTEM] + [message(i) for i in range(3)]
+        journal.append(message(3))
+    with SessionJournal("s", root=str(tmp_path)) as journal:
+        assert journal.load() == [SYSTEM] + [message(i) for i in range(4)]
+
+
+def test_recover_indexes_records_missing_from_index(tmp_path):
+    # A crash between the journal write and the index write
+    journal_with(tmp_path, 4).close()
+    index = os.path.join(tmp_path, "s.index")
+    with open(index, "r+b") as f:
+        f.truncate(session_journal._FILE_HEADER.size + 2 * session_journal._ENTRY.size)
+
+    with SessionJournal("s", root=str(tmp_path)) as journal:
+        assert journal.load() == [SYSTEM] + [message(i) for i in range(4)]
+
+
+def test_recover_drops_index_entries_past_the_journal(tmp_path):
+    journal_with(tmp_path, 4).close()
+    path = os.path.join(tmp_path, "s.journal")
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - 3)  # last record torn; its index entry is stale
+
+    with SessionJournal("s", root=str(tmp_path)) as journal:
+        assert journal.load() == [SYSTEM] + [message(i) for i in range(3)]
+        journal.append(message(9))
+        assert journal.load()[-1] == message(9)
+
+
+@pytest.mark.parametrize("damage", ["missing", "torn", "other_generation"])
+def test_recover_rebuilds_unusable_index(tmp_path, damage):
+    journal_with(tmp_path, 3).close()
+    index = os.path.join(tmp_path, "s.index")
+    if damage == "missing":
+        os.remove(index)
+    elif damage == "torn":
+        with open(index, "ab") as f:
+            f.write(b"\x01\x02\x03")
+    else:
+        with open(index, "r+b") as f:
+            f.seek(len(session_journal._INDEX_MAGIC))
+            f.write(b"\x00" * 8)
+
+    with SessionJournal("s", root=str(tmp_path)) as journal:
+        assert journal.load() == [SYSTEM] + [message(i) for i in range(3)]
+
+
+def test_pop_survives_reopen(tmp_path):
+    journal = journal_with(tmp_path, 5)
+    journal.pop(2)
+    journal.append(message(7))
+    expected = [SYSTEM] + [message(i) for i in range(3)] + [message(7)]
+    assert journal.load() == expected
+    journal.close()
+    with SessionJournal("s", root=str(tmp_path)) as journal:
+        assert journal.load() == expected
+
+
+def test_compact_keeps_records_appended_while_it_runs(tmp_path, monkeypatch):
+    journal = journal_with(tmp_path, 20)
+    journal.pop(10)
+    expected = [SYSTEM] + [message(i) for i in range(10)]
+
+    # Hold the compactor after it has read the record count, then write meanwhile
+    started, resume_compaction = threading.Event(), threading.Event()
+    new_files = session_journal._new_files
+
+    def paused_new_files(*args):
+        started.set()
+        resume_compaction.wait(5)
+        return new_files(*args)
+
+    monkeypatch.setattr(session_journal, "_new_files", paused_new_files)
+    compactor = journal.compact_in_background()
+    assert started.wait(5)
+    for i in range(100, 105):
+        journal.append(message(i))
+    journal.pop()
+    expected += [message(i) for i in range(100, 104)]
+    resume_compaction.set()
+    compactor.join(5)
+    assert not compactor.is_alive()
+
+    assert journal.load() == expected
+    journal.append(message(200))
+    expected.append(message(200))
+    assert journal.load() == expected
+    journal.close()
+    with SessionJournal("s", root=str(tmp_path)) as journal:
+        assert journal.load() == expected
+    assert not os.path.exists(os.path.join(tmp_path, "s.journal.compact"))
+
+
+def test_compact_drops_dead_records(tmp_path):
+    journal = journal_with(tmp_path, 50)
+    journal.pop(40)
+    size = os.path.getsize(os.path.join(tmp_path, "s.journal"))
+    journal.compact()
+    assert os.path.getsize(os.path.join(tmp_path, "s.journal")) < size / 2
+    assert journal.load() == [SYSTEM] + [message(i) for i in range(10)]
+    journal.close()
+
+
+def test_budgeted_load_does_not_start_with_orphaned_tool_result(tmp_path):
+    with SessionJournal("s", root=str(tmp_path), token_counter=lambda m: 10) as journal:
+        journal.append(SYSTEM)
+        journal.append({"role": "user", "content": "Where is my order?"})
+        journal.append({"role": "assistant", "tool_calls": [{"id": "call_1"}]})
+        journal.append({"role": "tool", "tool_call_id": "call_1", "content": "{}"})
+        journal.append({"role": "assistant", "content": "Tomorrow."})
+        # Room for two messages after the system prompt: the tool result would lead
+        assert journal.load(budget_tokens=30) == [SYSTEM, {"role": "assistant", "content": "Tomorrow."}]
+
+
+def test_history_truncate_is_journaled(tmp_path):
+    history = resume("s", root=str(tmp_path))
+    history.append(SYSTEM)
+    turn_start = len(history)
+    history.append({"role": "user", "content": "hi"})
+    history.append({"role": "assistant", "tool_calls": [{"id": "call_1"}]})
+    history.truncate(turn_start)
+    assert history == [SYSTEM]
+    history.journal.close()
+    resumed = resume("s", root=str(tmp_path))
+    assert resumed == [SYSTEM]
+    resumed.journal.close()
+
+
+@pytest.mark.parametrize(
+    "edit",
+    [
+        lambda h: h.__delitem__(0),
+        lambda h: h.__setitem__(0, {}),
+        lambda h: h.insert(0, {}),
+        lambda h: h.clear(),
+        lambda h: h.remove(SYSTEM),
+    ],
+)
+def test_history_rejects_unjournaled_edits(tmp_path, edit):
+    journal = journal_with(tmp_path, 0)
+    history = JournaledHistory(journal, journal.load())
+    with pytest.raises(TypeError):
+        edit(history)
+    assert history == [SYSTEM]
+    journal.close()
@@ -0,0 +1,109 @@
+import json
+
+import pytest
+
+from cupertino import tool_parsing
+from cupertino.tool_parsing import ToolCallDetector, parse_tool_calls
+
+CALL = '{"name": "get_delivery_date", "arguments": {"order_id": "ORD-1"}}'
+
+
+def feed_all(detector: ToolCallDetector, segments) -> tuple:
+    """(streamed content, index of the segment that completed the call or None)."""
+    content, completed_at = "", None
+    for i, segment in enumerate(segments):
+        content += detector.feed(segment)
+        if detector.complete and completed_at is None:
+            completed_at = i
+    return content, completed_at
+
+
+def split_every(text: str, size: int) -> list:
+    return [text[i : i + size] for i in range(0, len(text), size)]
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 7])
+@pytest.mark.parametrize(
+    "fmt, markup",
+    [
+        ("huggingface", f"<tool_call>\n{CALL}\n</tool_call>"),
+        ("llama3", f"<|python_tag|>{CALL}"),
+        ("mistral", f"[TOOL_CALLS][{CALL}]"),
+    ],
+)
+def test_marker_split_across_segments(fmt, markup, size):
+    detector = ToolCallDetector(fmt, parallel_tool_calls=False)
+    content, completed_at = feed_all(detector, split_every("Let me check. " + markup, size))
+    assert content == "Let me check. "
+    assert completed_at is not None
+    [call] = detector.tool_calls()
+    assert call["function"]["name"] == "get_delivery_date"
+    assert json.loads(call["function"]["arguments"]) == {"order_id": "ORD-1"}
+
+
+def test_held_back_prefix_is_released_when_it_is_not_a_marker():
+    detector = ToolCallDetector("huggingface")
+    assert detector.feed("Use <tool") == "Use "
+    assert detector.feed("s> wisely") == "<tools> wisely"
+    assert detector.feed(" <") == " "
+    assert detector.flush() == "<"
+    assert detector.tool_calls() == []
+
+
+def test_close_tag_split_across_segments():
+    detector = ToolCallDetector("huggingface", parallel_tool_calls=False)
+    feed_all(detector, ["<tool_call>", CALL, "</tool", "_call"])
+    assert not detector.complete
+    detector.feed(">")
+    assert detector.complete
+
+
+def test_braces_inside_strings_do_not_close_the_payload():
+    arguments = '{"name": "note", "arguments": {"text": "a } ] \\" {"}}'
+    detector = ToolCallDetector("llama3")
+    split = arguments.index("]") + 1  # after the braces inside the string
+    feed_all(detector, ["<|python_tag|>", arguments[:split]])
+    assert not detector.complete
+    detector.feed(arguments[split:])
+    assert detector.complete
+
+
+def test_invalid_payload_never_completes():
+    detector = ToolCallDetector("mistral")
+    feed_all(detector, ["[TOOL_CALLS]", " oops [", CALL, "]"])
+    assert not detector.complete
+
+
+def test_parallel_calls_wait_for_the_next_block():
+    detector = ToolCallDetector("huggingface")
+    segments = ["<tool_call>", CALL, "</tool_call>", "\n", "<tool_call>", CALL, "</tool_call>", "Done"]
+    _, completed_at = feed_all(detector, segments)
+    assert completed_at == 7
+    assert len(detector.tool_calls()) == 2
+
+
+def test_parallel_wait_is_bounded():
+    detector = ToolCallDetector("huggingface")
+    _, completed_at = feed_all(detector, ["<tool_call>", CALL, "</tool_call>"] + ["\n"] * 20)
+    assert completed_at == 2 + tool_parsing._PARALLEL_GRACE_SEGMENTS
+
+
+def test_parallel_wait_allows_a_split_next_marker():
+    detector = ToolCallDetector("huggingface")
+    segments = ["<tool_call>", CALL, "</tool_call>", "\n<tool", "_call>", CALL, "</tool_call>"]
+    _, completed_at = feed_all(detector, segments)
+    assert completed_at is None  # still waiting for a possible third call
+    assert len(detector.tool_calls()) == 2
+
+
+def test_check_reports_tool_calls_once_complete():
+    detector = ToolCallDetector("huggingface", parallel_tool_calls=False)
+    assert detector.check("<tool_call>") is None
+    assert detector.check(CALL) is None
+    assert detector.check("</tool_call>") == "tool_calls"
+
+
+def test_parse_tool_calls_skips_malformed_entries():
+    text = f"<tool_call>{{bad json}}</tool_call><tool_call>{CALL}</tool_call><tool_call>{{\"arguments\": {{}}}}</tool_call>"
+    calls = parse_tool_calls(text)
+    assert [call["function"]["name"] for call in calls] == ["get_delivery_date"]
@@ -0,0 +1,63 @@
+import os
+import signal
+import time
+
+import pytest
+
+from cupertino import tool_sandbox
+from cupertino.tool_sandbox import ToolExecutionError, ToolSandbox, ToolTimeout, ToolWorkerCrashed
+
+TOOLS = {name: f"sandbox_tools:{name}" for name in ("echo", "fail", "crash", "spin", "sleep", "pid")}
+
+
+@pytest.fixture
+def sandbox():
+    with ToolSandbox(TOOLS, workers=1, shm_threshold=1024) as sandbox:
+        yield sandbox
+
+
+def test_round_trip_through_pipe_and_shared_memory(sandbox):
+    assert sandbox.call("echo", order_id="A1") == {"order_id": "A1"}
+    large = "x" * 100_000  # over shm_threshold both ways
+    assert sandbox.call("echo", text=large) == {"text": large}
+
+
+def test_tool_exception_keeps_the_worker(sandbox):
+    before = sandbox.call("pid")
+    with pytest.raises(ToolExecutionError, match="ValueError.*boom"):
+        sandbox.call("fail", message="boom")
+    assert sandbox.call("pid") == before
+
+
+def test_crash_mid_call_replaces_the_worker(sandbox):
+    before = sandbox.call("pid")
+    with pytest.raises(ToolWorkerCrashed, match="exit code 3"):
+        sandbox.call("crash")
+    assert sandbox.call("pid") != before
+
+
+def test_worker_killed_while_idle_is_replaced_before_the_next_call(sandbox):
+    before = sandbox.call("pid")
+    os.kill(before, signal.SIGKILL)
+    time.sleep(0.2)
+    assert sandbox.call("echo", order_id="B") == {"order_id": "B"}
+    assert sandbox.call("pid") != before
+
+
+def test_cpu_limit(sandbox):
+    with pytest.raises(ToolTimeout, match="CPU time limit"):
+        sandbox.submit("spin", {}, cpu_time=1).result(timeout=30)
+    assert sandbox.call("echo", ok=True) == {"ok": True}
+
+
+def test_wall_clock_backstop_kills_a_stuck_worker(sandbox, monkeypatch):
+    monkeypatch.setattr(tool_sandbox, "_WALL_CLOCK_GRACE", 0.2)
+    before = sandbox.call("pid")
+    with pytest.raises(ToolTimeout, match="restarted"):
+        sandbox.submit("sleep", {"seconds": 30}, cpu_time=0.1).result(timeout=30)
+    assert sandbox.call("pid") != before
+
+
+def test_unknown_tool(sandbox):
+    with pytest.raises(KeyError):
+        sandbox.submit("missing", {})